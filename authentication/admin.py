@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 # Register your models here.
-from authentication.models import Profile, User
+from authentication.models import EmailOutbox, Profile, User
 
 class UserProfileInline(admin.TabularInline):
     model = Profile
@@ -10,4 +10,12 @@ class UserProfileInline(admin.TabularInline):
 class UserAdmin(admin.ModelAdmin):
     list_display = ['email', 'first_name', 'last_name', 'is_verified', 'created_at', 'updated_at']
     list_filter = ['created_at', 'updated_at']
-    inlines = [UserProfileInline]
\ No newline at end of file
+    inlines = [UserProfileInline]
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to_email', 'status', 'attempts', 'next_attempt_at', 'created', 'sent_at']
+    list_filter = ['status', 'created']
+    search_fields = ['to_email']
+    readonly_fields = ['attempts', 'last_error', 'created', 'sent_at']
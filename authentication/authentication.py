@@ -0,0 +1,171 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from authentication.models import User
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of validated tokens, keyed by the SHA-256 of the raw token"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.tokens = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, raw_token):
+        key = hashlib.sha256(raw_token).hexdigest()
+        with self.lock:
+            token = self.tokens.get(key)
+            if token is not None:
+                self.tokens.move_to_end(key)
+        if token is None:
+            return None
+        try:
+            token.check_exp()
+        except TokenError:
+            self.discard(raw_token)
+            return None
+        return token
+
+    def set(self, raw_token, token):
+        key = hashlib.sha256(raw_token).hexdigest()
+        with self.lock:
+            self.tokens[key] = token
+            self.tokens.move_to_end(key)
+            while len(self.tokens) > self.max_size:
+                self.tokens.popitem(last=False)
+
+    def discard(self, raw_token):
+        with self.lock:
+            self.tokens.pop(hashlib.sha256(raw_token).hexdigest(), None)
+
+    def clear(self):
+        with self.lock:
+            self.tokens.clear()
+
+
+verified_tokens = VerifiedTokenCache(settings.JWT_VERIFIED_TOKEN_CACHE_SIZE)
+
+
+class ActiveUserCache:
+    """
+    Bounded LRU of the users' `is_active`, read again from the database once an entry is
+    older than `ttl` seconds. The database stays the source of truth: a user deactivated
+    by another process is refused here within `ttl`, right away when it happened in this one.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.users.get(user_id)
+            if entry is None:
+                return None
+            is_active, checked_at = entry
+            if time.monotonic() - checked_at > self.ttl:
+                del self.users[user_id]
+                return None
+            self.users.move_to_end(user_id)
+            return is_active
+
+    def set(self, user_id, is_active):
+        with self.lock:
+            self.users[user_id] = (is_active, time.monotonic())
+            self.users.move_to_end(user_id)
+            while len(self.users) > self.max_size:
+                self.users.popitem(last=False)
+
+    def discard(self, user_id):
+        with self.lock:
+            self.users.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+
+
+active_users = ActiveUserCache(settings.JWT_VERIFIED_TOKEN_CACHE_SIZE, settings.JWT_ACTIVE_USER_CHECK_INTERVAL)
+
+
+class LazyUser(SimpleLazyObject):
+    """
+    The user a token was issued to.
+
+    `pk`, `id`, `is_authenticated` and `is_anonymous` come from the token claims;
+    any other attribute loads the user once and keeps it for the rest of the request.
+    Query with `user_id=request.user.pk` rather than `user=request.user`, as the ORM
+    loads the user to read its model metadata.
+    """
+
+    def __init__(self, user_id):
+        def load():
+            user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+            if user is None:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            if not user.is_active:
+                raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+            return user
+
+        super().__init__(load)
+        self.__dict__.update(pk=user_id, id=user_id, is_authenticated=True, is_anonymous=False)
+
+    def __bool__(self):
+        # permission classes test `request.user and ...`
+        return True
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    `JWTAuthentication` without the per-request user query.
+
+    Signatures are checked once per token and the validated token is kept in a bounded
+    LRU until it expires. `request.user` is a `LazyUser`, so views that only need the
+    user id don't load the user; deactivated users are refused through `active_users`,
+    which costs one `is_active` query per user every `JWT_ACTIVE_USER_CHECK_INTERVAL`
+    seconds. That query is allowed on top of the view's `query_budget`.
+    """
+
+    def authenticate(self, request):
+        self.checked_user = False
+        result = super().authenticate(request)
+        budget = getattr(request._request, 'query_budget', None)
+        if self.checked_user and budget is not None:
+            request._request.query_budget = budget + 1
+        return result
+
+    def get_validated_token(self, raw_token):
+        token = verified_tokens.get(raw_token)
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            verified_tokens.set(raw_token, token)
+        return token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        is_active = active_users.get(user_id)
+        if is_active is None:
+            is_active = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values_list('is_active', flat=True).first()
+            self.checked_user = True
+            if is_active is None:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            active_users.set(user_id, is_active)
+        if not is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return LazyUser(user_id)
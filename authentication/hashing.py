@@ -0,0 +1,75 @@
+"""
+Password hashing off the request threads.
+
+PBKDF2 is deliberately slow, so a burst of logins or sign-ups can occupy every
+request thread and starve the rest of the API. The web process runs gunicorn's
+threaded workers (see the Procfile), and hashes are computed on a small pool per
+process (`hashlib` releases the GIL while hashing), capped at `PASSWORD_HASHING_WORKERS`
+running plus `PASSWORD_HASHING_MAX_PENDING` queued jobs. Past that, requests fail fast
+with a 503, so the other request threads of the process stay free for the rest of the API.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many sign-ins at the moment, please retry shortly'
+    default_code = 'hashing_busy'
+
+
+class BoundedExecutor:
+    """Thread pool that refuses work once `max_workers + max_pending` jobs are in"""
+
+    def __init__(self, max_workers, max_pending):
+        self.max_workers = max_workers
+        self.slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get_executor(self):
+        # created on first use, so forked workers don't inherit the parent's threads
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='password-hashing')
+            return self.executor
+
+    def submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+
+        def job():
+            try:
+                return fn(*args)
+            finally:
+                self.slots.release()
+
+        try:
+            return self.get_executor().submit(job)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def run(self, fn, *args):
+        """Runs `fn` on the pool and waits for it"""
+        return self.submit(fn, *args).result()
+
+
+password_hashing = BoundedExecutor(settings.PASSWORD_HASHING_WORKERS, settings.PASSWORD_HASHING_MAX_PENDING)
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Same `pbkdf2_sha256` hashes as Django's default hasher, computed on `password_hashing`.
+
+    Every path that hashes (`authenticate`, `set_password`, `check_password`) goes through
+    `encode`, so login, registration and password changes all use the pool.
+    """
+
+    def encode(self, password, salt, iterations=None):
+        return password_hashing.run(super().encode, password, salt, iterations)
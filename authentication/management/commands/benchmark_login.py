@@ -0,0 +1,77 @@
+import threading
+import time
+import uuid
+
+import requests
+from django.core.management.base import BaseCommand
+
+from authentication.models import User
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class Command(BaseCommand):
+    help = 'Measures catalog latency on a running server alone and during a login burst'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--catalog-workers', type=int, default=8)
+        parser.add_argument('--login-workers', type=int, default=32)
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per phase')
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/')
+        password = uuid.uuid4().hex
+        email = f'benchmark-{uuid.uuid4().hex[:8]}@example.com'
+        user = User.objects.create_user(email, 'Benchmark', 'User', '0', password=password)
+        User.objects.filter(pk=user.pk).update(is_verified=True)
+        try:
+            self.stdout.write('Catalog alone')
+            self.report(self.run_phase(base_url, options, email, password, login=False))
+            self.stdout.write('Catalog during a login burst')
+            self.report(self.run_phase(base_url, options, email, password, login=True))
+        finally:
+            user.delete()
+
+    def run_phase(self, base_url, options, email, password, login):
+        deadline = time.perf_counter() + options['duration']
+        results = {'catalog': [], 'login': []}
+        statuses = {'catalog': {}, 'login': {}}
+        lock = threading.Lock()
+
+        def worker(kind, request):
+            session = requests.Session()
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = request(session)
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    results[kind].append(elapsed)
+                    statuses[kind][response.status_code] = statuses[kind].get(response.status_code, 0) + 1
+
+        def browse(session):
+            return session.get(f'{base_url}/shop/products/')
+
+        def sign_in(session):
+            return session.post(f'{base_url}/user/login/', json={'email': email, 'password': password})
+
+        threads = [threading.Thread(target=worker, args=('catalog', browse)) for _ in range(options['catalog_workers'])]
+        if login:
+            threads += [threading.Thread(target=worker, args=('login', sign_in)) for _ in range(options['login_workers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {kind: (samples, statuses[kind]) for kind, samples in results.items() if samples}
+
+    def report(self, phase):
+        for kind, (samples, statuses) in phase.items():
+            self.stdout.write(
+                f'  {kind:8} {len(samples):6} requests  p50 {percentile(samples, 0.5):7.1f}ms  '
+                f'p99 {percentile(samples, 0.99):7.1f}ms  statuses {dict(sorted(statuses.items()))}'
+            )
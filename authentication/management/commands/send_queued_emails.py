@@ -0,0 +1,87 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from authentication.models import FAILED, PENDING, SENT, EmailOutbox
+from authentication.utils import MailUtil
+
+# how long a claimed batch stays hidden from other workers while it's being sent
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+class Command(BaseCommand):
+    help = 'Sends queued emails in batches over one connection, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--max-attempts', type=int, default=settings.EMAIL_OUTBOX_MAX_ATTEMPTS)
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting once it is drained')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to sleep between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = 0, 0
+            while True:
+                emails = self.claim_batch(options['batch_size'])
+                if not emails:
+                    break
+                batch_sent, batch_failed = self.send_batch(emails, options['max_attempts'])
+                sent += batch_sent
+                failed += batch_failed
+            if sent or failed or options['verbosity'] > 1:
+                self.stdout.write(f'Sent {sent} emails, {failed} failed')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
+
+    def claim_batch(self, batch_size):
+        """Due emails, pushed past `CLAIM_TIMEOUT` so the row locks can be released before sending"""
+        now = timezone.now()
+        with transaction.atomic():
+            emails = list(
+                EmailOutbox.objects.filter(status=PENDING, next_attempt_at__lte=now)
+                .order_by('next_attempt_at', 'id').select_for_update(skip_locked=True)[:batch_size]
+            )
+            if emails:
+                EmailOutbox.objects.filter(id__in=[email.id for email in emails]).update(next_attempt_at=now + CLAIM_TIMEOUT)
+        return emails
+
+    def send_batch(self, emails, max_attempts):
+        sent, failed = 0, 0
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as e:
+            for email in emails:
+                self.record_failure(email, e, max_attempts)
+            failed = len(emails)
+        else:
+            try:
+                for email in emails:
+                    try:
+                        MailUtil.build_email(email, connection=connection).send()
+                    except Exception as e:
+                        self.record_failure(email, e, max_attempts)
+                        failed += 1
+                    else:
+                        email.status, email.sent_at, email.last_error = SENT, timezone.now(), ''
+                        email.attempts += 1
+                        sent += 1
+            finally:
+                connection.close()
+        EmailOutbox.objects.bulk_update(emails, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+        return sent, failed
+
+    def record_failure(self, email, error, max_attempts):
+        email.attempts += 1
+        email.last_error = f'{type(error).__name__}: {error}'
+        if email.attempts >= max_attempts:
+            email.status = FAILED
+            return
+        delay = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+        email.next_attempt_at = timezone.now() + timedelta(seconds=min(delay, settings.EMAIL_OUTBOX_MAX_RETRY_DELAY))
@@ -4,6 +4,7 @@ from django.db import models
 # Create your models here.
 from django.contrib.auth.models import (AbstractBaseUser, BaseUserManager, PermissionsMixin)
 from django.db import models
+from django.utils import timezone
 from authentication.utils import AuthUtil
 from rest_framework_simplejwt.tokens import RefreshToken
 
@@ -78,3 +79,36 @@ class Profile(models.Model):
     def __str__(self):
         return f'Profile for user {self.user.email}'
 
+
+
+PENDING = 'PENDING'
+SENT = 'SENT'
+FAILED = 'FAILED'
+
+EMAIL_STATUSES = (
+    (PENDING, PENDING),
+    (SENT, SENT),
+    (FAILED, FAILED),
+)
+
+
+class EmailOutbox(models.Model):
+    """Emails written with the transaction that triggers them, sent by `manage.py send_queued_emails`"""
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    to_email = models.EmailField(max_length=255)
+    status = models.CharField(choices=EMAIL_STATUSES, max_length=20, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-created',)
+        indexes = [
+            models.Index(fields=['next_attempt_at', 'id'], condition=models.Q(status=PENDING), name='auth_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {self.to_email} ({self.status})'
@@ -0,0 +1,105 @@
+"""
+Revoked refresh tokens, checked without a query per refresh.
+
+Each worker keeps a Bloom filter of the JTIs blacklisted and not yet expired. A JTI
+the filter has never seen can't be blacklisted, so only possible hits are confirmed
+against `BlacklistedToken`, which stays the source of truth. Blacklisting a token
+bumps a generation counter in the shared cache (see `authentication.signals`), and
+workers rebuild their filter the next time they see a new generation. Without a shared
+cache (`SHARED_CACHE`) a worker would never see the others' bumps, so every refresh
+checks the blacklist table instead.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+REVOKED_TOKENS_GENERATION_KEY = 'auth:revoked:generation'
+
+
+def get_revoked_generation():
+    generation = cache.get(REVOKED_TOKENS_GENERATION_KEY)
+    if generation is None:
+        # start from the clock so a lost key can never bring back an old generation
+        cache.add(REVOKED_TOKENS_GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.get(REVOKED_TOKENS_GENERATION_KEY)
+    return generation
+
+
+def bump_revoked_generation():
+    try:
+        return cache.incr(REVOKED_TOKENS_GENERATION_KEY)
+    except ValueError:
+        generation = time.time_ns()
+        cache.set(REVOKED_TOKENS_GENERATION_KEY, generation, timeout=None)
+        return generation
+
+
+class BloomFilter:
+    """Set membership with false positives at roughly `error_rate` and no false negatives"""
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, value):
+        # double hashing: two 64 bit halves of one digest give every probe position
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(value))
+
+
+class RevokedTokens:
+    """Per-worker Bloom filter of revoked JTIs, rebuilt when the shared generation changes"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.generation = None
+        self.filter = None
+
+    def load(self, generation):
+        # the generation is read before the query, so a revocation committed meanwhile triggers another load
+        jtis = list(BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list('token__jti', flat=True))
+        bloom = BloomFilter(max(self.capacity, 2 * len(jtis)), self.error_rate)
+        for jti in jtis:
+            bloom.add(jti)
+        self.filter, self.generation = bloom, generation
+
+    def might_contain(self, jti):
+        if not settings.SHARED_CACHE:
+            return True
+        generation = get_revoked_generation()
+        if generation != self.generation:
+            with self.lock:
+                if generation != self.generation:
+                    self.load(generation)
+        return jti in self.filter
+
+    def add(self, jti):
+        """Marks a token revoked by this worker right away, before the generation is bumped"""
+        with self.lock:
+            if self.filter is not None:
+                self.filter.add(jti)
+
+    def clear(self):
+        with self.lock:
+            self.generation, self.filter = None, None
+
+
+revoked_tokens = RevokedTokens(settings.JWT_REVOKED_TOKENS_CAPACITY, settings.JWT_REVOKED_TOKENS_ERROR_RATE)
@@ -8,8 +8,9 @@ from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from rest_framework.exceptions import AuthenticationFailed
 from django.contrib.sites.shortcuts import get_current_site
 from django.urls import reverse
-from rest_framework_simplejwt.tokens import RefreshToken, TokenError
+from rest_framework_simplejwt.tokens import TokenError
 
+from authentication.tokens import RevocableRefreshToken
 from authentication.utils import MailUtil
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -152,7 +153,7 @@ class LogoutSerializer(serializers.Serializer):
     def save(self, **kwargs):
 
         try:
-            RefreshToken(self.token).blacklist()
+            RevocableRefreshToken(self.token).blacklist()
         except TokenError:
             self.fail('bad_token')
 
@@ -0,0 +1,21 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from authentication.authentication import active_users
+from authentication.models import User
+from authentication.revocation import bump_revoked_generation
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def invalidate_revoked_tokens(sender, **kwargs):
+    # bump after commit so no worker rebuilds its filter without the new row
+    transaction.on_commit(bump_revoked_generation)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_status(sender, instance, **kwargs):
+    # read again on the next request to this worker; the others catch up within JWT_ACTIVE_USER_CHECK_INTERVAL
+    active_users.discard(instance.pk)
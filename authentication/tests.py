@@ -1,3 +1,310 @@
-from django.test import TestCase
+import threading
+import time
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, identify_hasher, make_password
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.authentication import LazyUser, active_users, verified_tokens
+from authentication.hashing import BoundedExecutor, HashingBusy, PooledPBKDF2PasswordHasher, password_hashing
+from authentication.models import FAILED, PENDING, SENT, EmailOutbox, User
+from authentication.revocation import BloomFilter, RevokedTokens, get_revoked_generation, revoked_tokens
+from authentication.tokens import RevocableRefreshToken
+from authentication.utils import MailUtil
+from config.querycount import max_queries
+
+
+class CachedJWTAuthenticationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000000', password='secret')
+
+    def setUp(self):
+        verified_tokens.clear()
+        active_users.clear()
+        cache.clear()
+        self.token = AccessToken.for_user(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_no_user_query_for_id_only_views(self):
+        # is_active is checked once, then the view's query alone
+        with max_queries(2):
+            response = self.client.get(reverse('orders_list'))
+        self.assertEqual(response.status_code, 200)
+        for name in ('orders_list', 'saved-items'):
+            with max_queries(1):
+                response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(verified_tokens.tokens), 1)
+
+    def test_user_loaded_once_when_needed(self):
+        # the addresses, then the user for its names
+        with max_queries(2):
+            response = self.client.get(reverse('address-list'))
+        self.assertEqual(response.status_code, 200)
+
+        user = LazyUser(self.user.pk)
+        with max_queries(1):
+            self.assertEqual((user.pk, user.email, user.first_name), (self.user.pk, self.user.email, 'Buyer'))
+
+    def test_inactive_user_rejected_when_loaded(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.client.put(reverse('password-change'), {
+            'old_password': 'secret', 'new_password': 'changed', 'new_password_2': 'changed'
+        }, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('secret'))
+
+    def test_deactivated_user_rejected_on_id_only_views(self):
+        self.assertEqual(self.client.get(reverse('orders_list')).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+
+        # the token already verified by this worker, and a new one
+        for token in (self.token, AccessToken.for_user(self.user)):
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.assertEqual(self.client.get(reverse('orders_list')).status_code, 401)
+
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('orders_list')).status_code, 200)
+
+    def test_deactivation_by_another_process_applies_within_interval(self):
+        self.assertEqual(self.client.get(reverse('orders_list')).status_code, 200)
+        # no signal reaches this worker
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(reverse('orders_list')).status_code, 200)
+
+        later = time.monotonic() + settings.JWT_ACTIVE_USER_CHECK_INTERVAL + 1
+        with mock.patch('authentication.authentication.time.monotonic', return_value=later):
+            self.assertEqual(self.client.get(reverse('orders_list')).status_code, 401)
+
+    def test_invalid_token_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer not-a-token')
+        self.assertEqual(self.client.get(reverse('orders_list')).status_code, 401)
+
+
+class PasswordHashingPoolTest(TestCase):
+
+    def test_pool_used_for_new_and_stored_hashes(self):
+        self.assertIsInstance(identify_hasher(make_password('secret')), PooledPBKDF2PasswordHasher)
+        stored = PBKDF2PasswordHasher().encode('secret', 'salt')
+        self.assertIsInstance(identify_hasher(stored), PooledPBKDF2PasswordHasher)
+        with mock.patch.object(password_hashing, 'run', wraps=password_hashing.run) as run:
+            self.assertTrue(check_password('secret', stored))
+        run.assert_called_once()
+
+    def test_hashes_match_default_hasher(self):
+        encoded = PooledPBKDF2PasswordHasher().encode('secret', 'salt', 1000)
+        self.assertEqual(encoded, PBKDF2PasswordHasher().encode('secret', 'salt', 1000))
+        self.assertTrue(check_password('secret', encoded))
+
+    def test_full_pool_fails_fast(self):
+        pool = BoundedExecutor(max_workers=1, max_pending=1)
+        release = threading.Event()
+        running = [pool.submit(release.wait), pool.submit(release.wait)]
+        with self.assertRaises(HashingBusy):
+            pool.submit(release.wait)
+        release.set()
+        for future in running:
+            future.result()
+        self.assertTrue(pool.run(lambda: True))
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_OUTBOX_RETRY_DELAY=60)
+class EmailOutboxTest(TestCase):
+
+    def send_queued(self, *args):
+        call_command('send_queued_emails', *args, stdout=StringIO())
+
+    def test_registration_queues_email_until_worker_runs(self):
+        response = APIClient().post(reverse('register'), {
+            'email': 'new@example.com', 'first_name': 'New', 'last_name': 'Buyer',
+            'phone': '08000000001', 'password': 'secret123',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailOutbox.objects.get().status, PENDING)
+
+        self.send_queued()
+        self.assertEqual([message.to for message in mail.outbox], [['new@example.com']])
+        email = EmailOutbox.objects.get()
+        self.assertEqual((email.status, email.attempts), (SENT, 1))
+        self.assertIsNotNone(email.sent_at)
+
+    def test_failures_back_off_then_give_up(self):
+        MailUtil.send_email({'email_subject': 'Hi', 'email_body': 'Body', 'to_email': 'buyer@example.com'})
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=OSError('connection reset')):
+            self.send_queued('--max-attempts', '2')
+            email = EmailOutbox.objects.get()
+            self.assertEqual((email.status, email.attempts), (PENDING, 1))
+            self.assertEqual(email.last_error, 'OSError: connection reset')
+            self.assertGreater(email.next_attempt_at, timezone.now())
+
+            # not due yet
+            self.send_queued('--max-attempts', '2')
+            self.assertEqual(EmailOutbox.objects.get().attempts, 1)
+
+            EmailOutbox.objects.update(next_attempt_at=timezone.now())
+            self.send_queued('--max-attempts', '2')
+        email = EmailOutbox.objects.get()
+        self.assertEqual((email.status, email.attempts), (FAILED, 2))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_batch_shares_one_connection(self):
+        for i in range(3):
+            MailUtil.send_email({'email_subject': 'Hi', 'email_body': 'Body', 'to_email': f'buyer{i}@example.com'})
+        with mock.patch.object(EmailBackend, 'open', autospec=True, return_value=True) as opened:
+            self.send_queued('--batch-size', '10')
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(EmailOutbox.objects.exclude(status=SENT).exists())
+
+
+class RevokedTokensTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000000', password='secret')
+
+    def setUp(self):
+        revoked_tokens.clear()
+        self.client = APIClient()
+
+    def refresh(self, token):
+        return self.client.post(reverse('token-refresh'), {'refresh': str(token)}, format='json')
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        members = [f'jti-{i}' for i in range(1000)]
+        for member in members:
+            bloom.add(member)
+        self.assertTrue(all(member in bloom for member in members))
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_refresh_skips_blacklist_query(self):
+        token = RevocableRefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, 200)
+        with max_queries(0):
+            self.assertEqual(self.refresh(token).status_code, 200)
+
+    def test_logout_revokes_across_workers(self):
+        token = RevocableRefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, 200)
+        other_worker = RevokedTokens(100, 0.01)
+        self.assertFalse(other_worker.might_contain(token['jti']))
+
+        generation = get_revoked_generation()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token.access_token}')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('logout'), {'refresh': str(token)}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertNotEqual(get_revoked_generation(), generation)
+
+        self.assertTrue(other_worker.might_contain(token['jti']))
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_refresh_checks_blacklist_without_shared_cache(self):
+        token = RevocableRefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token).status_code, 200)
+        token.blacklist()
+        # the blacklist row is not broadcast to the other workers, each refresh asks the database
+        self.assertTrue(RevokedTokens(100, 0.01).might_contain(token['jti']))
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_prune_deletes_expired_tokens_in_batches(self):
+        live = RevocableRefreshToken.for_user(self.user)
+        expired = [RevocableRefreshToken.for_user(self.user) for _ in range(3)]
+        expired[0].blacklist()
+        OutstandingToken.objects.filter(jti__in=[token['jti'] for token in expired]).update(expires_at=timezone.now())
+
+        out = StringIO()
+        call_command('prune_expired_tokens', '--batch-size', '2', stdout=out)
+        self.assertIn('Deleted 3 expired tokens, 1 of them blacklisted', out.getvalue())
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), [live['jti']])
+
+
+@override_settings(THROTTLE_ENABLED=True, THROTTLE_NUM_PROXIES=0, THROTTLE_RULES={
+    'login': [('ip', 5, 60), ('email', 2, 60)],
+    'products_list': [('user', 1, 60)],
+})
+class ThrottleMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000000', password='secret')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def login(self, email, **extra):
+        return self.client.post(reverse('login'), {'email': email, 'password': 'wrong-password'}, format='json', **extra)
+
+    def test_login_limited_by_email_before_hashing(self):
+        with mock.patch.object(PooledPBKDF2PasswordHasher, 'encode', return_value='') as encode:
+            for _ in range(2):
+                self.assertNotEqual(self.login('Buyer@example.com').status_code, 429)
+        self.assertTrue(encode.called)
+        with mock.patch.object(PooledPBKDF2PasswordHasher, 'encode') as encode, max_queries(0):
+            response = self.login('buyer@example.com ')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['status'], 'Failed')
+        self.assertGreater(int(response['Retry-After']), 0)
+        encode.assert_not_called()
+
+        # another account from the same address still gets its attempt
+        self.assertNotEqual(self.login('other@example.com').status_code, 429)
+
+    def test_login_limited_by_ip(self):
+        for i in range(5):
+            self.assertNotEqual(self.login(f'user{i}@example.com').status_code, 429)
+        self.assertEqual(self.login('user9@example.com').status_code, 429)
+        self.assertNotEqual(self.login('user9@example.com', REMOTE_ADDR='10.0.0.2').status_code, 429)
+
+    def test_forwarded_for_ignored_without_proxies(self):
+        for i in range(5):
+            self.login(f'user{i}@example.com', HTTP_X_FORWARDED_FOR=f'203.0.113.{i}')
+        self.assertEqual(self.login('user9@example.com', HTTP_X_FORWARDED_FOR='203.0.113.9').status_code, 429)
+
+    @override_settings(THROTTLE_NUM_PROXIES=1)
+    def test_ip_read_from_the_router_entry(self):
+        # the router appends the address it saw, a client can only prepend made-up ones
+        for i in range(5):
+            self.login(f'user{i}@example.com', HTTP_X_FORWARDED_FOR=f'10.0.0.{i}, 203.0.113.7', REMOTE_ADDR='10.1.1.1')
+        response = self.login('user9@example.com', HTTP_X_FORWARDED_FOR='10.0.0.9, 203.0.113.7', REMOTE_ADDR='10.1.1.1')
+        self.assertEqual(response.status_code, 429)
+        response = self.login('user9@example.com', HTTP_X_FORWARDED_FOR='203.0.113.8', REMOTE_ADDR='10.1.1.1')
+        self.assertNotEqual(response.status_code, 429)
+
+    def test_catalog_limited_per_user(self):
+        other = User.objects.create_user('other@example.com', 'Other', 'Example', '08000000001', password='secret')
+        for user in (self.user, other):
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+            self.assertEqual(self.client.get(reverse('products_list')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('products_list')).status_code, 429)
+
+        # anonymous requests aren't keyed by user
+        self.client.credentials()
+        self.assertEqual(self.client.get(reverse('products_list')).status_code, 200)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_refuses_to_count_in_a_per_process_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.login('buyer@example.com')
@@ -0,0 +1,22 @@
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authentication.revocation import revoked_tokens
+
+
+class RevocableRefreshToken(RefreshToken):
+    """`RefreshToken` that only queries the blacklist when `revoked_tokens` can't rule the JTI out"""
+
+    def check_blacklist(self):
+        if revoked_tokens.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
+
+    def blacklist(self):
+        result = super().blacklist()
+        revoked_tokens.add(self.payload[api_settings.JTI_CLAIM])
+        return result
+
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RevocableRefreshToken
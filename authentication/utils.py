@@ -7,5 +7,10 @@ class AuthUtil:
 class MailUtil:
     @staticmethod
     def send_email(data):
-        email = EmailMessage(subject=data.get("email_subject"), body=data.get("email_body"), to=[data.get("to_email")])
-        email.send()
\ No newline at end of file
+        """Queues the email in the outbox, it's sent after commit by `manage.py send_queued_emails`"""
+        from authentication.models import EmailOutbox
+        EmailOutbox.objects.create(subject=data.get("email_subject"), body=data.get("email_body"), to_email=data.get("to_email"))
+
+    @staticmethod
+    def build_email(outbox_email, connection=None):
+        return EmailMessage(subject=outbox_email.subject, body=outbox_email.body, to=[outbox_email.to_email], connection=connection)
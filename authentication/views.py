@@ -6,6 +6,7 @@ from rest_framework.views import APIView
 from authentication.serializers import EmailVerificationSerializer, PasswordChangeSerializer, RequestVerificationLinkSerializer, SavedItemsSerializer, ProfileSerializer, LoginSerializer, LogoutSerializer, RegisterSerializer, RequestPasswordResetEmailSerializer, SetNewPasswordSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 from authentication.models import Profile, User
+from authentication.hashing import HashingBusy
 from authentication.utils import MailUtil
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.contrib.sites.shortcuts import get_current_site
@@ -16,8 +17,10 @@ import jwt
 from django.conf import settings
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from shop.models import Product
+from shop.models import Product, RecentlyViewed
+from shop.recent import recent_views
 from django.db import transaction
+from django.db.models import F
 class RegisterView(generics.GenericAPIView):
 
     serializer_class = RegisterSerializer
@@ -254,8 +257,7 @@ class ListAddressesAPIView(generics.GenericAPIView):
     def get(self, request):
         user = request.user
         try:
-            user = User.objects.get(email=user)
-            address_list = list(Profile.objects.filter(user=user).values('address', 'city', 'state', 'country'))
+            address_list = list(Profile.objects.filter(user_id=user.pk).values('address', 'city', 'state', 'country'))
             address_list = [{
                 'first_name': user.first_name,
                 'last_name': user.last_name,
@@ -280,15 +282,14 @@ class ListAddressesAPIView(generics.GenericAPIView):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         try:
-            user = User.objects.get(email=user)
-            if Profile.objects.filter(user=user).exists():
+            if Profile.objects.filter(user_id=user.pk).exists():
                 return Response({
                 'status': 'Failed', 
                 'message': 'Address already exists', 
                 'data': []
                 }, status=status.HTTP_401_UNAUTHORIZED)
             profile = Profile.objects.create(
-                user=user,
+                user_id=user.pk,
                 **data
             )
             profile.save()
@@ -311,8 +312,7 @@ class ListAddressesAPIView(generics.GenericAPIView):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         try:
-            user = User.objects.get(email=user)
-            Profile.objects.filter(user=user).update(
+            Profile.objects.filter(user_id=user.pk).update(
                 **data
             )
         except:
@@ -331,8 +331,7 @@ class ListAddressesAPIView(generics.GenericAPIView):
     def delete(self, request):
         user = request.user
         try:
-            user = User.objects.get(email=user)
-            address = Profile.objects.filter(user=user)
+            address = Profile.objects.filter(user_id=user.pk)
             address.delete()
         except:
             return Response({
@@ -358,7 +357,6 @@ class UpdateProfileAPIView(generics.GenericAPIView):
         user = request.user
         data = request.data
         try:
-            user = User.objects.get(email=user)
             first_name = request.data.pop('first_name', None)
             last_name = request.data.pop('last_name', None)
             user.first_name = first_name if first_name else user.first_name
@@ -367,7 +365,7 @@ class UpdateProfileAPIView(generics.GenericAPIView):
             serializer = self.serializer_class(data=request.data)
             serializer.is_valid(raise_exception=True)
             
-            Profile.objects.filter(user=user).update(
+            Profile.objects.filter(user_id=user.pk).update(
                 **data
             )
         except:
@@ -393,7 +391,6 @@ class PasswordChangeAPIView(generics.GenericAPIView):
     def put(self, request):
         user = request.user
         try:
-            user = User.objects.get(email=user)
             serializer = self.serializer_class(data=request.data)
             serializer.is_valid(raise_exception=True)
             old_password = request.data.get('old_password', '')
@@ -405,6 +402,8 @@ class PasswordChangeAPIView(generics.GenericAPIView):
                 raise ValidationError('Current Password Incorrect')
             user.set_password(new_password)
             user.save()
+        except HashingBusy:
+            raise
         except:
             return Response({
                 'status': 'Failed', 
@@ -432,7 +431,6 @@ class SavedItemsAPIView(generics.GenericAPIView):
         action = request.data.get('action', None)
         try:
             product = Product.objects.get(id=product_id)
-            user = User.objects.get(email=user)
             if action == 'like':
                 user.saved_products.add(product)
             if action == 'dislike':
@@ -460,8 +458,7 @@ class SavedItemsAPIView(generics.GenericAPIView):
     def get(self, request):
         user = request.user
         try:
-            user = User.objects.get(email=user)
-            saved_items = list(user.saved_products.all().values('id', 'category__id', 'category__name', 'name', 'slug', 'image', 'price'))
+            saved_items = list(Product.objects.filter(user_favorites__id=user.pk).values('id', 'category__id', 'category__name', 'name', 'slug', 'image', 'price'))
             return Response({
                 'status': 'Success', 
                 'message': 'Saved items loaded successfully', 
@@ -480,7 +477,6 @@ class SavedItemsAPIView(generics.GenericAPIView):
         product_id = self.request.query_params.get("product_id")
         message = None
         try:
-            user = User.objects.get(email=user)
             if product_id is not None:
                 product = Product.objects.get(id=product_id)
                 user.saved_products.remove(product)
@@ -511,8 +507,13 @@ class RecentItemsAPIView(generics.GenericAPIView):
     def get(self, request):
         user = request.user
         try:
-            user = User.objects.get(email=user)
-            recent_items = list(user.recent_products.all().values('id', 'category__id', 'category__name', 'name', 'slug', 'image', 'price'))
+            recent_views.flush(user.pk)
+            recent_items = list(
+                Product.objects.filter(recent_views__user_id=user.pk)
+                .order_by('-recent_views__viewed_at')
+                .values('id', 'category__id', 'category__name', 'name', 'slug', 'image', 'price', viewed_at=F('recent_views__viewed_at'))
+                [:settings.RECENTLY_VIEWED_LIMIT]
+            )
             return Response({
                 'status': 'Success', 
                 'message': 'Recent items loaded successfully', 
@@ -531,13 +532,13 @@ class RecentItemsAPIView(generics.GenericAPIView):
         product_id = self.request.query_params.get("product_id")
         message = None
         try:
-            user = User.objects.get(email=user)
+            recent_views.flush(user.pk)
             if product_id is not None:
                 product = Product.objects.get(id=product_id)
-                user.recent_products.remove(product)
+                RecentlyViewed.objects.filter(user_id=user.pk, product=product).delete()
                 message = f'{product.name} removed from recently viewed products'
             else:
-                user.recent_products.clear()
+                RecentlyViewed.objects.filter(user_id=user.pk).delete()
             return Response({
                 'status': 'Success', 
                 'message': message if message else 'Recently Viewed Products Cleared', 
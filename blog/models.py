@@ -2,6 +2,7 @@ from email.policy import default
 from django.db import models
 from django.utils import timezone
 from authentication.models import User
+from config.images import ImageVariantsMixin
 from taggit.managers import TaggableManager
 
 # Create your models here.
@@ -10,7 +11,7 @@ class PublishedManager(models.Manager):
         return super(PublishedManager, self).get_queryset().filter(status='published')
 
 
-class Post(models.Model):
+class Post(ImageVariantsMixin, models.Model):
     STATUS_CHOICES = (
         ('draft', 'Draft'),
         ('published', 'Published')
@@ -21,6 +22,8 @@ class Post(models.Model):
     slug = models.SlugField(max_length=250, unique_for_date='publish')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='blog_posts')
     image = models.ImageField(upload_to='toyosi-assets/images/posts/%Y/%m/%d', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image_variants_stale = models.BooleanField(default=False, editable=False)
     body = models.TextField()
     publish = models.DateTimeField(default=timezone.now)
     created = models.DateTimeField(auto_now_add=True)
@@ -33,6 +36,9 @@ class Post(models.Model):
 
     class Meta:
         ordering = ('-publish',)
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(image_variants_stale=True), name='blog_post_variants_stale_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -1,11 +1,13 @@
 from rest_framework import serializers
 from blog.models import Comment, Post
 from taggit_serializer.serializers import TaggitSerializer, TagListSerializerField
+from config.images import ImageSrcsetField
 
 class PostSerializer(TaggitSerializer, serializers.ModelSerializer):
     tags = TagListSerializerField()
+    image_srcset = ImageSrcsetField()
     class Meta:
-        fields = ('id','slug', 'title', 'description', 'body', 'image', 'publish', 'tags')
+        fields = ('id','slug', 'title', 'description', 'body', 'image', 'image_srcset', 'publish', 'tags')
         model = Post
         lookup_field = 'slug'
         extra_kwargs = {
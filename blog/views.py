@@ -9,32 +9,35 @@ from django.db import transaction
 class PostListView(generics.ListAPIView):
     # queryset = Post.published.all()
     serializer_class = PostSerializer
+    query_budget = 3
 
     def get_queryset(self):
 
-        queryset = Post.published.all()
+        queryset = Post.published.prefetch_related('tags')
         query = self.request.query_params.get("search")
 
         if query is not None:
             search_vector = SearchVector('title', weight='A') + SearchVector('body', weight='B')
             search_query = SearchQuery(query)
-            queryset = Post.published.annotate(rank=SearchRank(search_vector, search_query)
+            queryset = queryset.annotate(rank=SearchRank(search_vector, search_query)
             ).filter(rank__gt=0.2).order_by('-rank')
 
         return queryset
 
 class PostDetailView(generics.RetrieveAPIView):
-    queryset = Post.published.all()
+    queryset = Post.published.prefetch_related('tags')
     serializer_class = PostSerializer
     lookup_field = 'slug'
+    query_budget = 2
 
     # def get_queryset(self):
     #     slug = self.kwargs.get('slug')
     #     return Post.published.filter(slug=slug).first()
 
 class PostRecentView(generics.ListAPIView):
-    queryset = Post.published.all()[:3]
+    queryset = Post.published.prefetch_related('tags')[:3]
     serializer_class = PostSerializer
+    query_budget = 3
 
 class PostSimilarView(generics.GenericAPIView):
     serializer_class = PostSerializer
@@ -0,0 +1,112 @@
+"""
+`Idempotency-Key` support for unsafe API methods.
+
+The first response to a key is stored in the database (`orders.IdempotencyKey`) for
+`IDEMPOTENCY_KEY_TIMEOUT` seconds; retries with the same key get it back without
+running the view again. While the first request runs, retries get a 409 for at most
+`IDEMPOTENCY_IN_PROGRESS_TIMEOUT` seconds. Keys are scoped to the user and the URL,
+and a key reused with a different body is rejected.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from orders.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def claim(scope, fingerprint):
+    """
+    Claims `scope` for this request in one statement, autocommitted so every worker sees it.
+
+    The row is taken over when it expired, or when its request has been running for longer
+    than a request can (the worker died mid-request). Returns the id of the claimed row,
+    or `None` and the stored `(fingerprint, status_code, data)` when another request has it.
+    """
+    table = IdempotencyKey._meta.db_table
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        # the SELECT sees the row as it was before the INSERT, if there was one
+        cursor.execute(
+            f'WITH claimed AS ('
+            f'INSERT INTO {table} (key, fingerprint, status_code, data, locked_until, expires) '
+            f'VALUES (%s, %s, NULL, NULL, %s, %s) '
+            f'ON CONFLICT (key) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, status_code = NULL, data = NULL, '
+            f'locked_until = EXCLUDED.locked_until, expires = EXCLUDED.expires '
+            f'WHERE {table}.expires <= %s OR ({table}.status_code IS NULL AND {table}.locked_until <= %s) '
+            f'RETURNING id'
+            f') '
+            f'SELECT (SELECT id FROM claimed), stored.fingerprint, stored.status_code, stored.data::text '
+            f'FROM (SELECT 1) AS one LEFT JOIN {table} stored ON stored.key = %s',
+            [
+                scope, fingerprint,
+                now + timedelta(seconds=settings.IDEMPOTENCY_IN_PROGRESS_TIMEOUT),
+                now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TIMEOUT),
+                now, now, scope,
+            ]
+        )
+        claimed_id, *stored = cursor.fetchone()
+    return claimed_id, stored
+
+
+def release(claimed_id, response):
+    """Stores the response to replay, or frees the key if the request may succeed on a retry"""
+    # the views answer unexpected errors with 401, those may succeed on a retry
+    if response is not None and response.status_code < 500 and response.status_code != status.HTTP_401_UNAUTHORIZED:
+        IdempotencyKey.objects.filter(id=claimed_id).update(
+            status_code=response.status_code,
+            data=response.data,
+            locked_until=None
+        )
+    else:
+        IdempotencyKey.objects.filter(id=claimed_id).delete()
+
+
+def idempotent(handler):
+    """Decorates an APIView handler such as `post(self, request)`"""
+
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return handler(view, request, *args, **kwargs)
+
+        user_id = request.user.pk if request.user.is_authenticated else 'anonymous'
+        scope = hashlib.md5(f'{user_id}:{request.method}:{request.path}:{key}'.encode('utf-8')).hexdigest()
+        fingerprint = hashlib.md5(request.body).hexdigest()
+
+        # only one request per key does the work, concurrent retries are told to come back
+        claimed_id, (stored_fingerprint, status_code, data) = claim(scope, fingerprint)
+        if claimed_id is None:
+            if status_code is None:
+                return Response({
+                    'status': 'Failed', 
+                    'message': 'A request with this Idempotency-Key is in progress', 
+                    'data': []
+                    }, status=status.HTTP_409_CONFLICT)
+            if stored_fingerprint != fingerprint:
+                return Response({
+                    'status': 'Failed', 
+                    'message': 'Idempotency-Key already used for a different request', 
+                    'data': []
+                    }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            response = Response(json.loads(data), status=status_code)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        response = None
+        try:
+            response = handler(view, request, *args, **kwargs)
+        finally:
+            release(claimed_id, response)
+        return response
+
+    return wrapper
@@ -0,0 +1,173 @@
+"""
+Responsive variants of uploaded images.
+
+Every image field has a JSON companion (`image_variants`) holding the original's
+dimensions and a set of resized WebP copies (`IMAGE_VARIANTS`), written through the
+storage named by `IMAGE_VARIANTS_STORAGE`. Any Django storage works, so tests can use
+`FileSystemStorage` while production stores the variants next to the originals on Cloudinary.
+
+Uploads only save the original and flag the row (`<variants field>_stale`, see
+`ImageVariantsMixin`): variants are generated off the request path by
+`manage.py generate_image_variants --loop`, which picks up the flagged rows through a
+partial index. Until then `image_srcset` serves the original alone.
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, get_storage_class
+from django.db.models import Q
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+
+def get_variants_storage():
+    return get_storage_class(settings.IMAGE_VARIANTS_STORAGE)()
+
+
+def generate_variants(field_file, storage=None):
+    """Resizes `field_file` into every configured variant and stores them"""
+    storage = storage or get_variants_storage()
+    with field_file.open('rb'):
+        image = Image.open(field_file)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    root = os.path.splitext(field_file.name)[0]
+    variants = {}
+    for name, size in settings.IMAGE_VARIANTS.items():
+        variant = image.copy()
+        variant.thumbnail((size, size), Image.LANCZOS)
+        buffer = BytesIO()
+        variant.save(buffer, 'WEBP', quality=settings.IMAGE_VARIANTS_QUALITY)
+        path = storage.save(f'{root}_{name}.webp', ContentFile(buffer.getvalue()))
+        variants[name] = {'name': path, 'width': variant.width, 'height': variant.height}
+
+    return {
+        'source': field_file.name,
+        'width': image.width,
+        'height': image.height,
+        'variants': variants,
+    }
+
+
+def delete_variants(data, keep=(), storage=None):
+    """Deletes the stored variant files of `data`, except the names in `keep`"""
+    storage = storage or get_variants_storage()
+    for value in (data or {}).get('variants', {}).values():
+        if value['name'] in keep:
+            continue
+        try:
+            storage.delete(value['name'])
+        except Exception:
+            logger.exception(f'Failed to delete image variant {value["name"]}')
+
+
+def variants_outdated(field_file, data):
+    """Whether `data` was generated from another file than `field_file`, or is left from a removed one"""
+    if field_file:
+        return (data or {}).get('source') != field_file.name
+    return bool(data)
+
+
+class ImageVariantsMixin:
+    """
+    Flags the rows whose variants no longer match their image when they are saved.
+
+    `image_variants_fields` lists `(image field, variants field)` pairs, each variants
+    field having a boolean `<variants field>_stale` companion.
+    """
+    image_variants_fields = (('image', 'image_variants'),)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        for field_name, variants_field in self.image_variants_fields:
+            stale_field = f'{variants_field}_stale'
+            setattr(self, stale_field, variants_outdated(getattr(self, field_name), getattr(self, variants_field)))
+            if update_fields is not None and field_name in update_fields:
+                kwargs['update_fields'] = update_fields = {*update_fields, stale_field}
+        super().save(*args, **kwargs)
+
+
+def refresh_variants(instance, field_name, variants_field='image_variants'):
+    """
+    Regenerates the variants of `instance.<field_name>` when the file changed,
+    deletes the files of the variants it replaces and clears the stale flag.
+
+    Saves with `update()` so post_save handlers don't run again, and only if the image
+    is still the one the variants were made from. Returns whether anything changed.
+    """
+    model = type(instance)
+    stale_field = f'{variants_field}_stale'
+    field_file = getattr(instance, field_name)
+    current = getattr(instance, variants_field) or {}
+    if field_file:
+        unchanged = Q(**{field_name: field_file.name})
+    else:
+        unchanged = Q(**{field_name: ''}) | Q(**{f'{field_name}__isnull': True})
+    if not variants_outdated(field_file, current):
+        model._base_manager.filter(unchanged, pk=instance.pk).update(**{stale_field: False})
+        return False
+
+    data = {}
+    if field_file:
+        try:
+            data = generate_variants(field_file)
+        except Exception:
+            # recorded without variants, so the worker doesn't retry a broken upload forever
+            logger.exception(f'Failed to generate image variants for {field_file.name}')
+            data = {'source': field_file.name, 'variants': {}}
+    updated = model._base_manager.filter(unchanged, pk=instance.pk).update(**{variants_field: data, stale_field: False})
+    if not updated:
+        # replaced meanwhile, the row stays flagged for the next pass
+        delete_variants(data)
+        return False
+    setattr(instance, variants_field, data)
+    delete_variants(current, keep={value['name'] for value in data.get('variants', {}).values()})
+    return True
+
+
+def image_srcset(name, data, storage=None):
+    """
+    `srcset`-style description of a stored image.
+
+        {"url": ..., "width": 1600, "height": 1200,
+         "variants": {"thumbnail": {"url": ..., "width": 150, "height": 113}, ...},
+         "srcset": "<thumbnail url> 150w, <medium url> 600w, ..."}
+    """
+    if not name:
+        return None
+    data = data if data and data.get('source') == name else {}
+    storage = storage or get_variants_storage()
+    variants = {
+        variant: {'url': storage.url(value['name']), 'width': value['width'], 'height': value['height']}
+        for variant, value in data.get('variants', {}).items()
+    }
+    return {
+        'url': default_storage.url(name),
+        'width': data.get('width'),
+        'height': data.get('height'),
+        'variants': variants,
+        'srcset': ', '.join(f'{value["url"]} {value["width"]}w' for value in variants.values()),
+    }
+
+
+class ImageSrcsetField(serializers.Field):
+    """Read-only `image_srcset` of an image field and its variants field"""
+
+    def __init__(self, image_field='image', variants_field='image_variants', **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+        self.image_field = image_field
+        self.variants_field = variants_field
+        self.model_fields = (image_field, variants_field)
+
+    def to_representation(self, instance):
+        return image_srcset(getattr(instance, self.image_field).name, getattr(instance, self.variants_field))
@@ -0,0 +1,133 @@
+"""
+Per-request SQL accounting.
+
+`QueryCountMiddleware` records every query a request runs (count, DB time and
+repeated statement shapes) and compares the count with the `query_budget`
+declared on the view class. `max_queries` does the same for arbitrary blocks
+of code and is meant to be used in tests.
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def sql_shape(sql):
+    """Strips the literals out of `sql` so repeated statements compare equal"""
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return LITERAL_RE.sub('?', sql)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder:
+    """Records the queries executed on `using` while active"""
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.queries = []
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        self._stack.enter_context(connections[self.using].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(duration for _, duration in self.queries)
+
+    def duplicates(self):
+        """Statement shapes executed more than once, most repeated first"""
+        shapes = Counter(sql_shape(sql) for sql, _ in self.queries)
+        return [(shape, count) for shape, count in shapes.most_common() if count > 1]
+
+    def report(self, budget=None):
+        lines = [f'{self.count} queries in {self.duration * 1000:.1f}ms' + (f' (budget {budget})' if budget is not None else '')]
+        for shape, count in self.duplicates():
+            lines.append(f'  {count}x {shape}')
+        return '\n'.join(lines)
+
+
+class max_queries(ContextDecorator):
+    """
+    Fails with `QueryBudgetExceeded` when the wrapped block runs more than `budget` queries.
+
+        with max_queries(2):
+            self.client.get(reverse('products_list'))
+    """
+
+    def __init__(self, budget, using=DEFAULT_DB_ALIAS):
+        self.budget = budget
+        self.using = using
+
+    def __enter__(self):
+        self.recorder = QueryRecorder(self.using).__enter__()
+        return self.recorder
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.recorder.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and self.recorder.count > self.budget:
+            raise QueryBudgetExceeded(self.recorder.report(self.budget))
+
+
+class QueryCountMiddleware:
+    """
+    Records the queries of every request and checks them against the view's `query_budget`.
+
+    Going over budget, or repeating a statement shape (an N+1), is logged as a warning.
+    With `QUERY_BUDGET_STRICT` it raises `QueryBudgetExceeded` instead; the test runner
+    (`config.test_runner`) turns it on, so the suite catches regressions.
+    `QUERY_COUNT_HEADERS` adds the numbers to the response.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.query_budget = None
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        response.query_stats = recorder
+
+        budget = request.query_budget
+        over_budget = budget is not None and recorder.count > budget
+        if over_budget or recorder.duplicates():
+            message = f'{request.method} {request.path}: {recorder.report(budget)}'
+            if over_budget and getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        if getattr(settings, 'QUERY_COUNT_HEADERS', False):
+            response['X-DB-Query-Count'] = recorder.count
+            response['X-DB-Time-Ms'] = f'{recorder.duration * 1000:.1f}'
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        request.query_budget = getattr(view_class, 'query_budget', None)
@@ -69,9 +69,11 @@ SWAGGER_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    'config.querycount.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     "corsheaders.middleware.CorsMiddleware",
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'config.throttling.ThrottleMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -80,6 +82,30 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Query accounting, see config/querycount.py
+QUERY_BUDGET_STRICT = int(os.environ.get('QUERY_BUDGET_STRICT', 0))
+TEST_RUNNER = 'config.test_runner.StrictQueryBudgetRunner'
+QUERY_COUNT_HEADERS = int(os.environ.get('QUERY_COUNT_HEADERS', DEBUG))
+
+# Rate limits, see config/throttling.py. URL name -> (key, max requests, window in seconds)
+# The counters must be seen by every process, so it's on with the shared cache (SHARED_CACHE below)
+THROTTLE_ENABLED = int(os.environ.get('THROTTLE_ENABLED', bool(os.environ.get('MEMCACHED_LOCATION'))))
+# Proxies appending to X-Forwarded-For in front of the app; the 'ip' key is the address the
+# outermost one saw. Heroku's router is one (set to 1 in app.json); with 0, clients connect
+# directly and the header, which they control, is ignored
+THROTTLE_NUM_PROXIES = int(os.environ.get('THROTTLE_NUM_PROXIES', 0))
+THROTTLE_RULES = {
+    'login': [('ip', 20, 60), ('email', 5, 60 * 5)],
+    'register': [('ip', 10, 60 * 60)],
+    'request-reset-email': [('ip', 5, 60 * 15), ('email', 3, 60 * 60)],
+    'request-verification-link': [('ip', 5, 60 * 15), ('email', 3, 60 * 60)],
+    'token-refresh': [('ip', 60, 60)],
+    'products_list': [('ip', 120, 60), ('user', 240, 60)],
+    'product_detail': [('ip', 240, 60), ('user', 480, 60)],
+    'categories_list': [('ip', 120, 60)],
+    'category_detail': [('ip', 120, 60)],
+}
+
 # CORS_ALLOW_ALL_ORIGINS = True
 
 CORS_ALLOWED_ORIGINS = [
@@ -132,20 +158,88 @@ db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
 
 
+# Cache
+# Shared across workers through memcached when MEMCACHED_LOCATION is set (docker-compose
+# runs a memcached service, see app.json for Heroku). Without it every process has its
+# own cache, so the features relying on cache invalidation or counters seen by all the
+# processes check SHARED_CACHE and stay off.
+
+SHARED_CACHE = bool(os.environ.get('MEMCACHED_LOCATION'))
+
+if SHARED_CACHE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.environ.get('MEMCACHED_LOCATION').split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 60 * 10))
+
+# Recently viewed products are buffered per worker, see shop/recent.py
+RECENT_VIEWS_FLUSH_SIZE = int(os.environ.get('RECENT_VIEWS_FLUSH_SIZE', 500))
+RECENT_VIEWS_FLUSH_INTERVAL = int(os.environ.get('RECENT_VIEWS_FLUSH_INTERVAL', 30))
+RECENTLY_VIEWED_LIMIT = int(os.environ.get('RECENTLY_VIEWED_LIMIT', 20))
+
+# Upper bounds of the price facet buckets, see shop/filters.py
+PRODUCT_PRICE_BUCKETS = [5000, 10000, 25000, 50000, 100000]
+
+# Responses replayed for retried `Idempotency-Key` requests, see config/idempotency.py
+IDEMPOTENCY_KEY_TIMEOUT = int(os.environ.get('IDEMPOTENCY_KEY_TIMEOUT', 60 * 60 * 24))
+# a bit longer than the gunicorn request timeout (30s)
+IDEMPOTENCY_IN_PROGRESS_TIMEOUT = int(os.environ.get('IDEMPOTENCY_IN_PROGRESS_TIMEOUT', 60))
+
+# Carts untouched for longer are deleted by `manage.py purge_abandoned_carts`
+ABANDONED_CART_TTL_DAYS = int(os.environ.get('ABANDONED_CART_TTL_DAYS', 30))
+
+# Items of an order detail are cached per order version (`updated`), see orders/views.py
+ORDER_ITEMS_CACHE_TIMEOUT = int(os.environ.get('ORDER_ITEMS_CACHE_TIMEOUT', 60 * 60 * 24))
+
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 100,
     'NON_FIELD_ERRORS_KEY': 'error',
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authentication.authentication.CachedJWTAuthentication',
     )
 }
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    'TOKEN_REFRESH_SERIALIZER': 'authentication.tokens.RevocableTokenRefreshSerializer',
 }
 
+# Validated access tokens kept per worker, see authentication/authentication.py
+JWT_VERIFIED_TOKEN_CACHE_SIZE = int(os.environ.get('JWT_VERIFIED_TOKEN_CACHE_SIZE', 4096))
+# seconds before a token's user is checked again for `is_active`
+JWT_ACTIVE_USER_CHECK_INTERVAL = int(os.environ.get('JWT_ACTIVE_USER_CHECK_INTERVAL', 10))
+
+# Bloom filter of revoked refresh tokens, see authentication/revocation.py
+JWT_REVOKED_TOKENS_CAPACITY = int(os.environ.get('JWT_REVOKED_TOKENS_CAPACITY', 10000))
+JWT_REVOKED_TOKENS_ERROR_RATE = float(os.environ.get('JWT_REVOKED_TOKENS_ERROR_RATE', 0.01))
+
+PASSWORD_HASHERS = [
+    # reads the stock pbkdf2_sha256 hashes too; listing Django's PBKDF2PasswordHasher
+    # after it would claim the algorithm back and verify logins on the request thread
+    'authentication.hashing.PooledPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+# Password hashes run on a bounded pool, see authentication/hashing.py;
+# keep workers + pending below the request threads of a web process (GUNICORN_THREADS, 8)
+PASSWORD_HASHING_WORKERS = int(os.environ.get('PASSWORD_HASHING_WORKERS', 2))
+PASSWORD_HASHING_MAX_PENDING = int(os.environ.get('PASSWORD_HASHING_MAX_PENDING', 2))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -205,6 +299,11 @@ EMAIL_PORT = 587
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 
+# Outbox retries back off exponentially from the delay, see send_queued_emails
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 6))
+EMAIL_OUTBOX_RETRY_DELAY = int(os.environ.get('EMAIL_OUTBOX_RETRY_DELAY', 60))
+EMAIL_OUTBOX_MAX_RETRY_DELAY = int(os.environ.get('EMAIL_OUTBOX_MAX_RETRY_DELAY', 60 * 60))
+
 CLOUDINARY_STORAGE = {
     'CLOUD_NAME': os.environ.get('CLOUD_NAME'),
     'API_KEY': os.environ.get('API_KEY'),
@@ -212,3 +311,12 @@ CLOUDINARY_STORAGE = {
 }
 
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+
+# Resized WebP variants of uploaded images, see config/images.py
+IMAGE_VARIANTS = {
+    'thumbnail': 150,
+    'medium': 600,
+    'large': 1200,
+}
+IMAGE_VARIANTS_QUALITY = 80
+IMAGE_VARIANTS_STORAGE = os.environ.get('IMAGE_VARIANTS_STORAGE', DEFAULT_FILE_STORAGE)
@@ -0,0 +1,19 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class StrictQueryBudgetRunner(DiscoverRunner):
+    """
+    Runs the tests with `QUERY_BUDGET_STRICT`, so a view going over its `query_budget` fails the test.
+
+    Also sets `SHARED_CACHE`: the test process is the only one using its local cache.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.strict_query_budget = override_settings(QUERY_BUDGET_STRICT=True, SHARED_CACHE=True)
+        self.strict_query_budget.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.strict_query_budget.disable()
+        super().teardown_test_environment(**kwargs)
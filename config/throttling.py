@@ -0,0 +1,134 @@
+"""
+Rate limiting in front of the views.
+
+`ThrottleMiddleware` applies the `THROTTLE_RULES` of the matched URL name before
+any view code runs, so a limited login never reaches the password hasher or the
+database. Each rule limits one key: the client IP, the user id from the JWT claims,
+or the email in the request body. Counts are a sliding window approximated from two
+fixed-window counters in the shared cache, so every check is a constant number of
+atomic `incr` and plain `get` calls and all workers see the same totals. Per-process
+caches would multiply the limits by the number of processes, so `THROTTLE_ENABLED`
+without `SHARED_CACHE` is a configuration error.
+"""
+import hashlib
+import json
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.settings import api_settings
+
+from authentication.authentication import CachedJWTAuthentication
+
+IP, USER, EMAIL = 'ip', 'user', 'email'
+
+
+def window_count(key, window, now):
+    """Adds a hit to the current window and returns the weighted count over the last `window` seconds"""
+    index, elapsed = divmod(now, window)
+    current_key, previous_key = f'{key}:{int(index)}', f'{key}:{int(index) - 1}'
+    # counters live for two windows, the next window still reads this one as its previous
+    cache.add(current_key, 0, timeout=2 * window)
+    try:
+        current = cache.incr(current_key)
+    except ValueError:
+        # evicted between add and incr
+        cache.set(current_key, 1, timeout=2 * window)
+        current = 1
+    previous = cache.get(previous_key, 0)
+    return previous * (1 - elapsed / window) + current, window - elapsed
+
+
+class ThrottleMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.authentication = CachedJWTAuthentication()
+
+    def __call__(self, request):
+        if settings.THROTTLE_ENABLED:
+            if not settings.SHARED_CACHE:
+                raise ImproperlyConfigured('THROTTLE_ENABLED needs a cache shared by all processes, set MEMCACHED_LOCATION')
+            response = self.check(request)
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def check(self, request):
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            return None
+        rules = settings.THROTTLE_RULES.get(url_name)
+        if not rules:
+            return None
+
+        now = time.time()
+        retry_after = 0
+        for scope, limit, window in rules:
+            ident = self.get_ident(request, scope)
+            if ident is None:
+                continue
+            digest = hashlib.md5(str(ident).encode('utf-8')).hexdigest()
+            count, reset = window_count(f'throttle:{url_name}:{scope}:{digest}', window, now)
+            if count > limit:
+                retry_after = max(retry_after, reset)
+        if not retry_after:
+            return None
+
+        response = JsonResponse({
+            'status': 'Failed',
+            'message': 'Too many requests, please retry later',
+            'data': []
+            }, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        response['Retry-After'] = str(math.ceil(retry_after))
+        return response
+
+    def get_ident(self, request, scope):
+        if scope == IP:
+            return self.get_client_ip(request)
+        if scope == USER:
+            return self.get_user_id(request)
+        if scope == EMAIL:
+            return self.get_email(request)
+        raise ValueError(f'Unknown throttle scope {scope!r}')
+
+    def get_client_ip(self, request):
+        # with THROTTLE_NUM_PROXIES proxies in front, the client is the address the outermost one saw
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+        if settings.THROTTLE_NUM_PROXIES and forwarded:
+            addresses = [address.strip() for address in forwarded.split(',')]
+            return addresses[-min(settings.THROTTLE_NUM_PROXIES, len(addresses))]
+        return request.META.get('REMOTE_ADDR')
+
+    def get_user_id(self, request):
+        """User id claim of a valid bearer token; tokens are verified once per worker, see `CachedJWTAuthentication`"""
+        header = self.authentication.get_header(request)
+        if header is None:
+            return None
+        try:
+            raw_token = self.authentication.get_raw_token(header)
+            if raw_token is None:
+                return None
+            return self.authentication.get_validated_token(raw_token).get(api_settings.USER_ID_CLAIM)
+        except APIException:
+            return None
+
+    def get_email(self, request):
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError:
+                return None
+        else:
+            data = request.POST
+        email = data.get('email') if hasattr(data, 'get') else None
+        if not isinstance(email, str) or not email.strip():
+            return None
+        return email.strip().lower()
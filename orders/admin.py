@@ -1,13 +1,54 @@
-from django.contrib import admin
-from orders.models import Order, OrderItem
+from django.contrib import admin, messages
+from orders.models import ORDER_CANCELED, ORDER_DELIVERED, ORDER_DISPATCHED, ORDER_RETURNED, Order, OrderItem, OrderStatusLog
+from orders.transitions import transition_orders
 
 # Register your models here.
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     raw_id_fields = ['product']
 
+class OrderStatusLogInline(admin.TabularInline):
+    model = OrderStatusLog
+    fields = ['from_status', 'to_status', 'actor', 'created']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'status', 'paid', 'created', 'updated']
-    list_filter = ['paid', 'created', 'updated']
-    inlines = [OrderItemInline]
\ No newline at end of file
+    list_display = ['id', 'user', 'status', 'paid', 'total', 'item_count', 'created', 'updated']
+    list_filter = ['status', 'paid', 'created', 'updated']
+    readonly_fields = ['total', 'item_count']
+    inlines = [OrderItemInline, OrderStatusLogInline]
+    actions = ['mark_dispatched', 'mark_delivered', 'mark_canceled', 'mark_returned']
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # inline items are saved one by one, recount once they are all in
+        Order.objects.refresh_totals([form.instance.pk])
+
+    def transition(self, request, queryset, target):
+        moved, skipped = transition_orders(queryset.values_list('id', flat=True), target, actor=request.user)
+        self.message_user(request, f'{len(moved)} orders moved to {target}')
+        if skipped:
+            self.message_user(request, f'{len(skipped)} orders can\'t move to {target} from their status', messages.WARNING)
+
+    @admin.action(description='Mark selected orders as dispatched')
+    def mark_dispatched(self, request, queryset):
+        self.transition(request, queryset, ORDER_DISPATCHED)
+
+    @admin.action(description='Mark selected orders as delivered')
+    def mark_delivered(self, request, queryset):
+        self.transition(request, queryset, ORDER_DELIVERED)
+
+    @admin.action(description='Cancel selected orders and restock their items')
+    def mark_canceled(self, request, queryset):
+        self.transition(request, queryset, ORDER_CANCELED)
+
+    @admin.action(description='Mark selected orders as returned')
+    def mark_returned(self, request, queryset):
+        self.transition(request, queryset, ORDER_RETURNED)
@@ -0,0 +1,112 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from orders.models import CART_RECEIPT_SQL, IN_CART, Order, OrderItem
+from shop.models import Product
+
+
+def lock_cart(user_id):
+    """
+    Returns the id of the user's cart, creating it if needed.
+
+    The upsert leaves the cart row locked until the transaction ends, so concurrent
+    mutations of the same cart queue up behind each other instead of racing.
+    New carts get a placeholder receipt number, the real one is allocated at checkout.
+    """
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {Order._meta.db_table} (user_id, status, meta, receipt_number, paid, total, item_count, created, updated) '
+            f"VALUES (%s, %s, '\"\"', {CART_RECEIPT_SQL}, false, 0, 0, %s, %s) "
+            f'ON CONFLICT (user_id) WHERE status = %s DO UPDATE SET updated = EXCLUDED.updated '
+            f'RETURNING id',
+            [user_id, IN_CART, now, now, IN_CART]
+        )
+        return cursor.fetchone()[0]
+
+
+@transaction.atomic
+def set_cart_item(user_id, product_id, quantity):
+    """
+    Sets the quantity of `product_id` in the user's cart in two statements.
+
+    New items take the current product price. The item upsert also refreshes the
+    cart `total` and `item_count`: the statement can't see the row it writes, so the
+    other items are summed and the written one is added from `RETURNING`.
+    Raises `Product.DoesNotExist`, leaving the cart untouched, when the product doesn't exist.
+    """
+    order_id = lock_cart(user_id)
+    table = OrderItem._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH item AS ('
+            f'INSERT INTO {table} (order_id, product_id, price, quantity) '
+            f'SELECT %s, p.id, p.price, %s FROM {Product._meta.db_table} p WHERE p.id = %s '
+            f'ON CONFLICT (order_id, product_id) DO UPDATE SET quantity = EXCLUDED.quantity '
+            f'RETURNING order_id, product_id, price, quantity'
+            f'), others AS ('
+            f'SELECT COALESCE(SUM(i.price * i.quantity), 0) AS total, COALESCE(SUM(i.quantity), 0) AS item_count '
+            f'FROM {table} i, item WHERE i.order_id = item.order_id AND i.product_id <> item.product_id'
+            f') '
+            f'UPDATE {Order._meta.db_table} o '
+            f'SET total = others.total + item.price * item.quantity, item_count = others.item_count + item.quantity, updated = %s '
+            f'FROM item, others WHERE o.id = item.order_id '
+            f'RETURNING o.id',
+            [order_id, quantity, product_id, timezone.now()]
+        )
+        row = cursor.fetchone()
+    if row is None:
+        raise Product.DoesNotExist(f'Product {product_id} does not exist')
+    return order_id
+
+SET, INCREMENT, REMOVE = 'set', 'increment', 'remove'
+
+
+@transaction.atomic
+def apply_cart_operations(user_id, operations):
+    """
+    Applies `[{'action': 'set'|'increment'|'remove', 'product_id': ..., 'quantity': ...}]`
+    to the user's cart in order, in one transaction.
+
+    Products and existing items are each read with one query and the changes are
+    written with `bulk_create`/`bulk_update`/a single delete, followed by one UPDATE
+    of the cart totals. Raises `Product.DoesNotExist`
+    if any product doesn't exist. Returns the cart id.
+    """
+    order_id = lock_cart(user_id)
+    product_ids = {operation['product_id'] for operation in operations}
+    products = Product.objects.only('id', 'price').in_bulk(product_ids)
+    missing = product_ids - set(products)
+    if missing:
+        raise Product.DoesNotExist(f'Products not found: {", ".join(str(id) for id in sorted(missing))}')
+
+    current = {item.product_id: item for item in OrderItem.objects.filter(order_id=order_id, product_id__in=product_ids)}
+    items = dict(current)
+    for operation in operations:
+        product_id = operation['product_id']
+        if operation['action'] == REMOVE:
+            items[product_id] = None
+            continue
+        item = items.get(product_id)
+        if item is None:
+            # removed and added back in the same batch, the row is reused at the current price
+            item = OrderItem(order_id=order_id, product_id=product_id, price=products[product_id].price, quantity=0)
+            if product_id in current:
+                item.pk = current[product_id].pk
+            items[product_id] = item
+        if operation['action'] == SET:
+            item.quantity = operation['quantity']
+        else:
+            item.quantity += operation['quantity']
+
+    removed = [current[product_id].pk for product_id, item in items.items() if item is None and product_id in current]
+    created = [item for product_id, item in items.items() if item is not None and product_id not in current]
+    updated = [item for product_id, item in items.items() if item is not None and product_id in current]
+    if removed:
+        OrderItem.objects.filter(pk__in=removed).delete()
+    if created:
+        OrderItem.objects.bulk_create(created)
+    if updated:
+        OrderItem.objects.bulk_update(updated, ['price', 'quantity'])
+    Order.objects.refresh_totals([order_id])
+    return order_id
@@ -0,0 +1,60 @@
+from django.db.models import Q
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from orders.models import IN_CART, STATUSES
+from shop.filters import ProductFilterBackend
+
+
+class OrderFilterBackend(BaseFilterBackend):
+    """Filters placed orders by `status` (comma separated) and `created_after`/`created_before`"""
+    params = {
+        'status': 'Comma separated order statuses',
+        'created_after': 'Date or datetime, inclusive',
+        'created_before': 'Date or datetime, inclusive',
+    }
+    statuses = [value for value, _ in STATUSES if value != IN_CART]
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        statuses = [value for value in params.get('status', '').split(',') if value]
+        unknown = set(statuses) - set(self.statuses)
+        if unknown:
+            raise ValidationError({'status': f'Unknown statuses: {", ".join(sorted(unknown))}'})
+        if statuses:
+            # an explicit status list keeps the scan on (user, status) ranges of the index
+            queryset = queryset.filter(status__in=statuses)
+        else:
+            # matches the predicate of the partial (user, -created, -id) index, which returns rows already in page order
+            queryset = queryset.filter(~Q(status=IN_CART))
+
+        return ProductFilterBackend().filter_created(queryset, params)
+
+    def get_schema_fields(self, view):
+        assert coreapi is not None, 'coreapi must be installed to use `get_schema_fields()`'
+        assert coreschema is not None, 'coreschema must be installed to use `get_schema_fields()`'
+        return [
+            coreapi.Field(
+                name=name,
+                required=False,
+                location='query',
+                schema=coreschema.String(description=description)
+            )
+            for name, description in self.params.items()
+        ]
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': name,
+                'required': False,
+                'in': 'query',
+                'description': description,
+                'schema': {
+                    'type': 'string',
+                },
+            }
+            for name, description in self.params.items()
+        ]
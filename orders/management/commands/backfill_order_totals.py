@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored total and item count of every order, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id, refreshed = 0, 0
+        while True:
+            ids = list(Order.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            # one short transaction per batch, so carts aren't locked for the whole run
+            with transaction.atomic():
+                refreshed += Order.objects.refresh_totals(ids, touch=False)
+            last_id = ids[-1]
+        self.stdout.write(f'{refreshed} orders refreshed')
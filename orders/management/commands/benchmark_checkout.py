@@ -0,0 +1,77 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from authentication.models import User
+from orders.cart import set_cart_item
+from orders.stock import OutOfStock, reserve_stock
+from shop.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Checks out one hot product from many concurrent workers and reports oversells'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16)
+        parser.add_argument('--buyers', type=int, default=200)
+        parser.add_argument('--stock', type=int, default=100)
+        parser.add_argument('--quantity', type=int, default=1)
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'Benchmark {run}', slug=f'benchmark-{run}')
+        product = Product.objects.create(category=category, name=f'Hot product {run}', slug=f'hot-product-{run}', price=1, stock=options['stock'])
+        users = User.objects.bulk_create([
+            User(username=f'benchmark-{run}-{i}', email=f'benchmark-{run}-{i}@example.com', first_name='Benchmark', last_name='Buyer', phone='0')
+            for i in range(options['buyers'])
+        ])
+        order_ids = [set_cart_item(user.pk, product.pk, options['quantity']) for user in users]
+
+        pending = list(order_ids)
+        lock = threading.Lock()
+        results = {'reserved': 0, 'out_of_stock': 0, 'errors': 0}
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        order_id = pending.pop()
+                    try:
+                        reserve_stock(order_id)
+                        outcome = 'reserved'
+                    except OutOfStock:
+                        outcome = 'out_of_stock'
+                    except Exception:
+                        outcome = 'errors'
+                    with lock:
+                        results[outcome] += 1
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        product.refresh_from_db()
+        expected = min(options['buyers'], options['stock'] // options['quantity'])
+        self.stdout.write(
+            f'{len(order_ids)} checkouts in {elapsed:.2f}s ({len(order_ids) / elapsed:.0f}/s) from {options["workers"]} workers: '
+            f'{results["reserved"]} reserved, {results["out_of_stock"]} out of stock, {results["errors"]} errors'
+        )
+        self.stdout.write(f'stock left {product.stock}, available {product.available}')
+        if results['reserved'] != expected or product.stock != options['stock'] - expected * options['quantity']:
+            self.stderr.write(self.style.ERROR(f'Expected {expected} reservations'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No oversell'))
+
+        User.objects.filter(pk__in=[user.pk for user in users]).delete()
+        category.delete()
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import IN_CART, Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = 'Deletes carts left untouched for longer than ABANDONED_CART_TTL_DAYS, in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-days', type=int, default=settings.ABANDONED_CART_TTL_DAYS)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the carts that would be deleted')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['ttl_days'])
+        abandoned = Order.objects.filter(status=IN_CART, updated__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write(f'{abandoned.count()} carts idle since {cutoff:%Y-%m-%d %H:%M} would be deleted')
+            return
+
+        carts, items = 0, 0
+        while True:
+            # one short transaction per chunk; carts being changed right now are skipped
+            with transaction.atomic():
+                ids = list(abandoned.order_by('id').select_for_update(skip_locked=True).values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                _, deleted = Order.objects.filter(id__in=ids).delete()
+            carts += deleted.get(Order._meta.label, 0)
+            items += deleted.get(OrderItem._meta.label, 0)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{carts} carts deleted so far')
+
+        self.stdout.write(f'Deleted {carts} carts and {items} cart items idle since {cutoff:%Y-%m-%d %H:%M}')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Deletes the expired Idempotency-Key responses, in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        expired = IdempotencyKey.objects.filter(expires__lte=timezone.now())
+        total = 0
+        while True:
+            # one short transaction per chunk; keys being claimed again right now are skipped
+            with transaction.atomic():
+                ids = list(expired.order_by('id').select_for_update(skip_locked=True).values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                deleted, _ = IdempotencyKey.objects.filter(id__in=ids).delete()
+            total += deleted
+        self.stdout.write(f'Deleted {total} expired idempotency keys')
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.16 on 2026-10-18 08:54
+
+from django.db import migrations
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Folds extra carts of a user into their latest one and keeps the latest
+    row of every duplicated cart item, so the constraints can be added.
+    """
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+
+    carts = {}
+    for order_id, user_id in Order.objects.filter(status='IN_CART').order_by('-updated', '-id').values_list('id', 'user_id'):
+        if user_id in carts:
+            OrderItem.objects.filter(order_id=order_id).update(order_id=carts[user_id])
+            Order.objects.filter(id=order_id).delete()
+        else:
+            carts[user_id] = order_id
+
+    seen = set()
+    duplicates = []
+    for item_id, order_id, product_id in OrderItem.objects.order_by('-id').values_list('id', 'order_id', 'product_id').iterator():
+        if (order_id, product_id) in seen:
+            duplicates.append(item_id)
+        seen.add((order_id, product_id))
+    OrderItem.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_auto_20221205_2028'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.16 on 2026-10-18 08:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_merge_duplicate_carts'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'IN_CART')), fields=('user',), name='orders_order_one_cart_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='orders_orderitem_order_product'),
+        ),
+    ]
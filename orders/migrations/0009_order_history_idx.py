@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 08:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_order_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status', '-created', '-id'], name='orders_user_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.16 on 2026-10-18 08:59
+
+from django.db import migrations
+from django.utils.http import int_to_base36
+
+# must match orders.models.RECEIPT_NUMBER_BLOCK_SIZE
+BLOCK_SIZE = 100
+
+
+def renumber_duplicate_receipts(apps, schema_editor):
+    """Gives every order but the first of a shared receipt number a fresh one"""
+    Order = apps.get_model('orders', 'Order')
+    seen = set()
+    with schema_editor.connection.cursor() as cursor:
+        for order_id, receipt_number in Order.objects.order_by('id').values_list('id', 'receipt_number').iterator():
+            if receipt_number not in seen:
+                seen.add(receipt_number)
+                continue
+            cursor.execute('SELECT nextval(%s)', ['orders_receipt_number_seq'])
+            receipt_number = f'R{int_to_base36(cursor.fetchone()[0]).upper().zfill(11)}'
+            Order.objects.filter(id=order_id).update(receipt_number=receipt_number)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_order_history_idx'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f'CREATE SEQUENCE orders_receipt_number_seq INCREMENT BY {BLOCK_SIZE} START WITH 1',
+            'DROP SEQUENCE orders_receipt_number_seq',
+        ),
+        migrations.RunPython(renumber_duplicate_receipts, migrations.RunPython.noop),
+    ]
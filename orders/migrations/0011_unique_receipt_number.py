@@ -0,0 +1,19 @@
+# Generated by Django 3.2.16 on 2026-10-18 08:59
+
+from django.db import migrations, models
+import orders.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_receipt_number_sequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='receipt_number',
+            field=models.CharField(default=orders.models.next_receipt_number, editable=False, max_length=50, unique=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 09:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0011_unique_receipt_number'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'IN_CART')), fields=['updated'], name='orders_cart_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.16 on 2026-10-18 09:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('orders', '0012_cart_updated_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('IN_CART', 'IN_CART'), ('ORDER_PLACED', 'ORDER_PLACED'), ('ORDER_CANCELED', 'ORDER_CANCELED'), ('ORDER_RETURNED', 'ORDER_RETURNED'), ('ORDER_DISPATCHED', 'ORDER_DISPATCHED'), ('ORDER_DELIVERED', 'ORDER_DELIVERED')], max_length=60)),
+                ('to_status', models.CharField(choices=[('IN_CART', 'IN_CART'), ('ORDER_PLACED', 'ORDER_PLACED'), ('ORDER_CANCELED', 'ORDER_CANCELED'), ('ORDER_RETURNED', 'ORDER_RETURNED'), ('ORDER_DISPATCHED', 'ORDER_DISPATCHED'), ('ORDER_DELIVERED', 'ORDER_DELIVERED')], max_length=60)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_transitions', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_log', to='orders.order')),
+            ],
+            options={
+                'ordering': ('-created',),
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 09:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0013_orderstatuslog'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'IN_CART'), _negated=True), fields=['user', '-created', '-id'], name='orders_user_history_idx'),
+        ),
+    ]
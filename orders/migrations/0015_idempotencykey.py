@@ -0,0 +1,26 @@
+# Generated by Django 3.2.16 on 2026-10-18 09:45
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0014_order_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=32, unique=True)),
+                ('fingerprint', models.CharField(max_length=32)),
+                ('status_code', models.PositiveSmallIntegerField(null=True)),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('locked_until', models.DateTimeField(null=True)),
+                ('expires', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -1,4 +1,11 @@
-from django.db import models
+import threading
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, JSONObject
+from django.utils import timezone
 from shop.models import Product
 from authentication.models import User, Profile
 import uuid
@@ -23,32 +30,136 @@ STATUSES = (
 
 
 
+SHIPPING_ADDRESS_FIELDS = ('first_name', 'last_name', 'email', 'phone', 'address', 'city', 'state', 'country')
+
 ID_LENGTH = 12
 
 
 def id_gen() -> str:
-    """Generates random string whose length is of `ID_LENGTH`"""
+    """Generates random string whose length is of `ID_LENGTH`, kept for the older migrations"""
     return int_to_base36(uuid.uuid4().int)[:ID_LENGTH]
 
+
+RECEIPT_NUMBER_SEQUENCE = 'orders_receipt_number_seq'
+RECEIPT_NUMBER_BLOCK_SIZE = 100
+
+
+class ReceiptNumberAllocator:
+    """
+    Hands out receipt numbers from blocks of `RECEIPT_NUMBER_BLOCK_SIZE` values.
+
+    The sequence is incremented by the block size, so each `nextval` reserves a whole
+    block for this process and only one in a hundred orders touches the sequence.
+    Numbers never collide across processes; gaps are expected. Receipts are
+    `R` followed by the upper case base36 number, so they can't clash with the
+    lower case `id_gen` receipts of older orders.
+    """
+
+    def __init__(self, sequence=RECEIPT_NUMBER_SEQUENCE, block_size=RECEIPT_NUMBER_BLOCK_SIZE):
+        self.sequence = sequence
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.next_value = self.end = 0
+
+    def __call__(self):
+        with self.lock:
+            if self.next_value >= self.end:
+                self.next_value = self.allocate()
+                self.end = self.next_value + self.block_size
+            value = self.next_value
+            self.next_value += 1
+        return f'R{int_to_base36(value).upper().zfill(ID_LENGTH - 1)}'
+
+    def allocate(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(%s)', [self.sequence])
+            return cursor.fetchone()[0]
+
+
+receipt_numbers = ReceiptNumberAllocator()
+
+
+def next_receipt_number() -> str:
+    return receipt_numbers()
+
+
+# carts created by `orders.cart.lock_cart` hold a random placeholder until checkout
+CART_RECEIPT_PREFIX = 'C'
+CART_RECEIPT_SQL = f"'{CART_RECEIPT_PREFIX}' || md5(random()::text || clock_timestamp()::text)"
+
+class OrderQuerySet(models.QuerySet):
+
+    def with_shipping_address(self):
+        """Annotates `shipping`, the first shipping address as a dict, without a second query"""
+        address = (
+            OrderDelivery.objects.filter(order=OuterRef('pk')).order_by('id')
+            .values(json=JSONObject(**{field: field for field in SHIPPING_ADDRESS_FIELDS}))[:1]
+        )
+        return self.annotate(shipping=Subquery(address, output_field=models.JSONField()))
+
+
+class OrderManager(models.Manager.from_queryset(OrderQuerySet)):
+
+    def refresh_totals(self, order_ids, touch=True):
+        """
+        Recomputes `total` and `item_count` of the given orders in a single UPDATE.
+
+        `touch` also bumps `updated`, as the items changed; backfills pass `touch=False`
+        so order history and the abandoned cart clock are left alone.
+        """
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        total = items.annotate(total=Sum(F('price') * F('quantity'), output_field=models.DecimalField())).values('total')
+        item_count = items.annotate(total=Sum('quantity')).values('total')
+        fields = {
+            'total': Coalesce(Subquery(total), Value(Decimal(0))),
+            'item_count': Coalesce(Subquery(item_count), 0),
+        }
+        if touch:
+            fields['updated'] = timezone.now()
+        return self.filter(id__in=order_ids).update(**fields)
+
+
 class Order(models.Model):
     user = models.ForeignKey(User, related_name='orders', on_delete=models.CASCADE)
     status = models.CharField(choices=STATUSES, max_length=60, default=IN_CART)
     meta = models.JSONField()
-    receipt_number = models.CharField(max_length=50, default=id_gen, editable=False)
+    receipt_number = models.CharField(max_length=50, default=next_receipt_number, unique=True, editable=False)
 
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     paid = models.BooleanField(default=False)
+    total = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False)
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = OrderManager()
 
     class Meta:
         ordering = ('-created',)
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=models.Q(status=IN_CART), name='orders_order_one_cart_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'status', '-created', '-id'], name='orders_user_status_created_idx'),
+            # default order history: every placed order of a user, newest first
+            models.Index(fields=['user', '-created', '-id'], condition=~models.Q(status=IN_CART), name='orders_user_history_idx'),
+            # small partial index for the abandoned cart purge
+            models.Index(fields=['updated'], condition=models.Q(status=IN_CART), name='orders_cart_updated_idx'),
+        ]
     
+    def save(self, *args, **kwargs):
+        # a cart leaving IN_CART (checkout, the admin) gets its real receipt number
+        if self.status != IN_CART and self.receipt_number.startswith(CART_RECEIPT_PREFIX):
+            self.receipt_number = next_receipt_number()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'receipt_number'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         formatted_id = str(self.id).zfill(5)
         return f'#TYS{formatted_id}'
     
     def get_total_cost(self):
-        return sum(item.get_cost() for item in self.items.all())
+        return self.total
 
 
 class OrderItem(models.Model):
@@ -57,6 +168,11 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=20, decimal_places=2)
     quantity = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='orders_orderitem_order_product'),
+        ]
+
     def __str__(self):
         return f'{self.order.__str__()} - {self.product.name}'
     
@@ -73,3 +189,33 @@ class OrderDelivery(models.Model):
     country = models.CharField(max_length=255, null=True, blank=True)
     city = models.CharField(max_length=255, null=True, blank=True)
     address = models.TextField(null=True, blank=True)
+
+
+class OrderStatusLog(models.Model):
+    order = models.ForeignKey(Order, related_name='status_log', on_delete=models.CASCADE)
+    from_status = models.CharField(choices=STATUSES, max_length=60)
+    to_status = models.CharField(choices=STATUSES, max_length=60)
+    actor = models.ForeignKey(User, related_name='order_transitions', null=True, blank=True, on_delete=models.SET_NULL)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('-created',)
+
+    def __str__(self):
+        return f'{self.order_id}: {self.from_status} -> {self.to_status}'
+
+
+class IdempotencyKey(models.Model):
+    """Outcome of a request sent with an `Idempotency-Key`, see config/idempotency.py"""
+    # digest of the user, method, path and key
+    key = models.CharField(max_length=32, unique=True)
+    fingerprint = models.CharField(max_length=32)
+    # null while the first request runs
+    status_code = models.PositiveSmallIntegerField(null=True)
+    data = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    locked_until = models.DateTimeField(null=True)
+    # deleted by `manage.py purge_idempotency_keys`
+    expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.key
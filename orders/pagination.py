@@ -0,0 +1,7 @@
+from shop.pagination import KeysetPagination
+
+
+class OrderHistoryPagination(KeysetPagination):
+    """Newest orders first, walked along the `(user, -created, -id)` partial index"""
+    ordering = ('-created', '-id')
+    page_size = 20
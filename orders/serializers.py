@@ -1,12 +1,14 @@
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from orders.cart import INCREMENT, REMOVE, SET
 from orders.models import Order
+from orders.transitions import TRANSITIONS
 
 class OrdersSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = '__all__'
+        fields = ('id', 'status', 'paid', 'created', 'receipt_number', 'total')
 
 class AddToCartSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
@@ -18,6 +20,20 @@ class AddToCartSerializer(serializers.Serializer):
             raise ValidationError('Invalid quantity')
         return super().validate(attrs)
 
+class CartOperationSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=(SET, INCREMENT, REMOVE))
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        quantity = attrs.get('quantity')
+        if attrs.get('action') != REMOVE and (quantity is None or quantity <= 0):
+            raise ValidationError('Invalid quantity')
+        return super().validate(attrs)
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
+
 class ShippingAdressObjectSerializer(serializers.Serializer):
     first_name = serializers.CharField(max_length=255, min_length=2)
     last_name = serializers.CharField(max_length=255, min_length=2)
@@ -40,3 +56,7 @@ class OrdersDetailSerializer(serializers.Serializer):
 
     def validate(self, attrs):
         return super().validate(attrs)
+
+class OrdersTransitionSerializer(serializers.Serializer):
+    order_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=10000)
+    status = serializers.ChoiceField(choices=sorted({target for targets in TRANSITIONS.values() for target in targets}))
@@ -0,0 +1,53 @@
+from django.db import connection, transaction
+
+from orders.models import OrderItem
+from shop.cache import bump_catalog_version
+from shop.models import Category, Product
+
+
+class OutOfStock(Exception):
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f'Not enough stock for products: {", ".join(str(id) for id in product_ids)}')
+
+
+@transaction.atomic
+def reserve_stock(order_id):
+    """
+    Takes the quantities of the order's items off the stock of their products.
+
+    One statement locks the tracked products in id order (so concurrent checkouts
+    can't deadlock) and decrements those with enough stock left with a conditional
+    UPDATE, flipping `available` off when they run out. If any line is short, nothing
+    is reserved and `OutOfStock` is raised. Products without tracked stock are skipped.
+    """
+    product_table = Product._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH lines AS ('
+            f'SELECT p.id AS product_id, i.quantity FROM {OrderItem._meta.db_table} i '
+            f'JOIN {product_table} p ON p.id = i.product_id '
+            f'WHERE i.order_id = %s AND p.stock IS NOT NULL '
+            f'ORDER BY p.id FOR UPDATE OF p'
+            f'), reserved AS ('
+            f'UPDATE {product_table} p '
+            f'SET stock = p.stock - lines.quantity, available = p.available AND p.stock > lines.quantity '
+            f'FROM lines WHERE p.id = lines.product_id AND p.stock >= lines.quantity '
+            f'RETURNING p.id, p.category_id, p.stock'
+            f') '
+            f'SELECT lines.product_id, reserved.id IS NOT NULL, reserved.category_id, reserved.stock '
+            f'FROM lines LEFT JOIN reserved ON reserved.id = lines.product_id',
+            [order_id]
+        )
+        rows = cursor.fetchall()
+
+    short = sorted(product_id for product_id, reserved, _, _ in rows if not reserved)
+    if short:
+        raise OutOfStock(short)
+
+    sold_out = {category_id for _, _, category_id, stock in rows if stock == 0}
+    if sold_out:
+        Category.objects.refresh_product_counts(sold_out)
+        transaction.on_commit(bump_catalog_version)
+    return len(rows)
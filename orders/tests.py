@@ -1,3 +1,470 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from authentication.models import Profile, User
+from orders.cart import set_cart_item
+from orders.filters import OrderFilterBackend
+from config.querycount import max_queries
+from orders.models import (CART_RECEIPT_PREFIX, IN_CART, ORDER_CANCELED, ORDER_DELIVERED, ORDER_DISPATCHED, ORDER_PLACED, IdempotencyKey,
+                           Order, OrderDelivery, OrderItem, OrderStatusLog, SHIPPING_ADDRESS_FIELDS, receipt_numbers)
+from orders.stock import OutOfStock, reserve_stock
+from orders.transitions import transition_orders
+from shop.models import Category, Product
+
+
+def create_catalog(count=3):
+    category = Category.objects.create(name='Category', slug='category')
+    return [
+        Product.objects.create(category=category, name=f'Product {i}', slug=f'product-{i}', price=1000 * (i + 1))
+        for i in range(count)
+    ]
+
+
+class CartUpsertTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000000', password='secret')
+        cls.products = create_catalog()
+
+    # an exhausted receipt block must not add a nextval to the cart upsert
+    @mock.patch.multiple(receipt_numbers, next_value=0, end=0)
+    def test_set_cart_item_in_two_statements(self):
+        with CaptureQueriesContext(connection) as queries:
+            order_id = set_cart_item(self.user.pk, self.products[0].pk, 2)
+        self.assertEqual(len([query for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]), 2)
+
+        set_cart_item(self.user.pk, self.products[0].pk, 5)
+        set_cart_item(self.user.pk, self.products[1].pk, 1)
+        order = Order.objects.filter(user=self.user, status=IN_CART).get()
+        self.assertEqual(order.pk, order_id)
+        self.assertEqual((order.total, order.item_count), (7000, 6))
+        self.assertEqual(
+            list(OrderItem.objects.filter(order_id=order_id).order_by('product_id').values_list('product_id', 'price', 'quantity')),
+            [(self.products[0].pk, 1000, 5), (self.products[1].pk, 2000, 1)]
+        )
+
+    def test_receipt_number_allocated_at_checkout(self):
+        order_id = set_cart_item(self.user.pk, self.products[0].pk, 1)
+        set_cart_item(self.user.pk, self.products[1].pk, 1)
+        order = Order.objects.get(id=order_id)
+        self.assertTrue(order.receipt_number.startswith(CART_RECEIPT_PREFIX))
+
+        order.status = ORDER_PLACED
+        order.save(update_fields=['status'])
+        receipt = Order.objects.values_list('receipt_number', flat=True).get(id=order_id)
+        self.assertTrue(receipt.startswith('R') and len(receipt) == 12)
+
+    def test_unknown_product_leaves_cart_untouched(self):
+        with self.assertRaises(Product.DoesNotExist):
+            set_cart_item(self.user.pk, 0, 1)
+        self.assertFalse(Order.objects.filter(user=self.user).exists())
+
+    def test_batch_operations(self):
+        first, second, third = self.products
+        set_cart_item(self.user.pk, first.pk, 2)
+        set_cart_item(self.user.pk, second.pk, 1)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(reverse('orders_cart_batch'), {'operations': [
+            {'action': 'increment', 'product_id': first.pk, 'quantity': 3},
+            {'action': 'remove', 'product_id': second.pk},
+            {'action': 'set', 'product_id': third.pk, 'quantity': 4},
+            {'action': 'increment', 'product_id': third.pk, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted((item['product_id'], item['quantity']) for item in response.data['data']),
+            [(first.pk, 5), (third.pk, 5)]
+        )
+        order = Order.objects.get(user=self.user, status=IN_CART)
+        self.assertEqual((order.total, order.item_count), (5 * 1000 + 5 * 3000, 10))
+
+    def test_batch_with_unknown_product_changes_nothing(self):
+        set_cart_item(self.user.pk, self.products[0].pk, 2)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(reverse('orders_cart_batch'), {'operations': [
+            {'action': 'remove', 'product_id': self.products[0].pk},
+            {'action': 'set', 'product_id': 0, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(list(OrderItem.objects.values_list('product_id', 'quantity')), [(self.products[0].pk, 2)])
+
+    def test_backfill_order_totals(self):
+        order_id = set_cart_item(self.user.pk, self.products[2].pk, 2)
+        updated = timezone.now() - timedelta(days=60)
+        Order.objects.filter(id=order_id).update(total=0, item_count=0, updated=updated)
+        call_command('backfill_order_totals', batch_size=1, stdout=StringIO())
+        self.assertEqual(Order.objects.filter(id=order_id).values_list('total', 'item_count', 'updated').get(), (6000, 2, updated))
+
+
+class CartConcurrencyTest(TransactionTestCase):
+
+    def test_parallel_adds_share_one_cart(self):
+        user = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000000', password='secret')
+        products = create_catalog()
+        workers = 12
+        barrier = threading.Barrier(workers)
+        errors = []
+
+        def add(product):
+            try:
+                barrier.wait()
+                set_cart_item(user.pk, product.pk, 1)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=add, args=(products[i % len(products)],)) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        order = Order.objects.get(user=user, status=IN_CART)
+        self.assertEqual(sorted(order.items.values_list('product_id', flat=True)), sorted(product.pk for product in products))
+
+
+class OrderHistoryTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000000', password='secret')
+        statuses = [ORDER_PLACED, ORDER_DELIVERED, ORDER_CANCELED]
+        Order.objects.bulk_create([
+            Order(user=cls.user, status=statuses[i % 3], meta={'note': 'x' * 100}) for i in range(11)
+        ])
+        Order.objects.create(user=cls.user, status=IN_CART, meta='')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_order_history_pages(self):
+        url = reverse('orders_list') + '?limit=4'
+        seen = []
+        while url:
+            with max_queries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.data['data']
+            seen += [order['id'] for order in data['results']]
+            url = data['next']
+        expected = Order.objects.exclude(status=IN_CART).order_by('-created', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+        self.assertEqual(set(data['results'][0]), {'id', 'status', 'paid', 'created', 'receipt_number', 'total'})
+
+    def test_default_history_reads_index_in_page_order(self):
+        request = APIRequestFactory().get(reverse('orders_list'))
+        queryset = OrderFilterBackend().filter_queryset(Request(request), Order.objects.filter(user_id=self.user.pk), None)
+        with connection.cursor() as cursor:
+            # tiny test tables would otherwise be read whole
+            cursor.execute('SET LOCAL enable_seqscan = off; SET LOCAL enable_bitmapscan = off')
+        plan = queryset.order_by('-created', '-id')[:20].explain()
+        self.assertIn('orders_user_history_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_order_history_filters(self):
+        response = self.client.get(reverse('orders_list'), {'status': ORDER_DELIVERED, 'created_after': '2000-01-01'})
+        self.assertEqual({order['status'] for order in response.data['data']['results']}, {ORDER_DELIVERED})
+        self.assertEqual(len(response.data['data']['results']), 4)
+
+        response = self.client.get(reverse('orders_list'), {'status': IN_CART})
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderDetailTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000000', password='secret')
+        Profile.objects.create(user=cls.user, city='Lagos')
+        products = create_catalog()
+        cls.order_id = set_cart_item(cls.user.pk, products[0].pk, 2)
+        set_cart_item(cls.user.pk, products[1].pk, 1)
+        OrderDelivery.objects.create(order_id=cls.order_id, first_name='Ship', last_name='To', city='Abuja')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_order_detail_in_two_queries_then_cached(self):
+        url = reverse('orders_detail', args=[self.order_id])
+        with max_queries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.data['data']
+        self.assertEqual(data['order_cost'], 4000)
+        self.assertEqual(data['billing_address']['city'], 'Lagos')
+        self.assertEqual(data['shipping_address']['city'], 'Abuja')
+        self.assertIsNone(data['shipping_address']['email'])
+        self.assertEqual(len(data['order_items']), 2)
+
+        with max_queries(1):
+            self.assertEqual(self.client.get(url).data['data'], data)
+
+        set_cart_item(self.user.pk, Product.objects.order_by('id').last().pk, 1)
+        self.assertEqual(len(self.client.get(url).data['data']['order_items']), 3)
+
+
+class ReceiptNumberTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000000', password='secret')
+        cls.other = User.objects.create_user('other@example.com', 'Other', 'Example', '08000000001', password='secret')
+        Profile.objects.create(user=cls.user)
+
+    def test_receipt_numbers_are_unique_across_blocks(self):
+        orders = Order.objects.bulk_create([Order(user=self.user, status=ORDER_PLACED, meta='') for _ in range(250)])
+        receipts = [order.receipt_number for order in orders]
+        self.assertEqual(len(set(receipts)), 250)
+        self.assertTrue(all(receipt.startswith('R') and len(receipt) == 12 for receipt in receipts))
+
+    def test_receipt_lookup(self):
+        order = Order.objects.create(user=self.user, status=ORDER_PLACED, meta='')
+        url = reverse('orders_receipt', args=[order.receipt_number])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['order_id'], order.id)
+
+        client.force_authenticate(self.other)
+        self.assertEqual(client.get(url).status_code, 404)
+        self.other.is_staff = True
+        self.assertEqual(client.get(url).status_code, 200)
+
+
+class StockReservationTest(TransactionTestCase):
+
+    def test_parallel_checkouts_never_oversell(self):
+        category = Category.objects.create(name='Category', slug='category')
+        product = Product.objects.create(category=category, name='Hot', slug='hot', price=10, stock=5)
+        users = [
+            User.objects.create_user(f'buyer{i}@example.com', 'Buyer', 'Example', f'0800000000{i}', password='secret')
+            for i in range(10)
+        ]
+        order_ids = [set_cart_item(user.pk, product.pk, 1) for user in users]
+        barrier = threading.Barrier(len(order_ids))
+        outcomes = []
+
+        def checkout(order_id):
+            try:
+                barrier.wait()
+                reserve_stock(order_id)
+                outcomes.append(True)
+            except OutOfStock:
+                outcomes.append(False)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout, args=(order_id,)) for order_id in order_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(outcomes), [False] * 5 + [True] * 5)
+        product.refresh_from_db()
+        self.assertEqual((product.stock, product.available), (0, False))
+        category.refresh_from_db()
+        self.assertEqual(category.available_product_count, 0)
+
+    def test_parallel_checkouts_of_same_order_place_it_once(self):
+        user = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000000', password='secret')
+        category = Category.objects.create(name='Category', slug='category')
+        product = Product.objects.create(category=category, name='Hot', slug='hot', price=10, stock=5)
+        order_id = set_cart_item(user.pk, product.pk, 2)
+        address = {field: 'Somewhere' for field in SHIPPING_ADDRESS_FIELDS}
+        barrier = threading.Barrier(2)
+        statuses = []
+
+        def checkout():
+            try:
+                client = APIClient()
+                client.force_authenticate(user)
+                barrier.wait()
+                response = client.post(reverse('orders_create'), {'order_id': order_id, 'shipping_address': address}, format='json')
+                statuses.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [200, 404])
+        self.assertEqual(Product.objects.values_list('stock', flat=True).get(pk=product.pk), 3)
+        self.assertEqual(OrderDelivery.objects.filter(order_id=order_id).count(), 1)
+
+    def test_checkout_rejected_when_short(self):
+        user = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000000', password='secret')
+        category = Category.objects.create(name='Category', slug='category')
+        tracked = Product.objects.create(category=category, name='Tracked', slug='tracked', price=10, stock=3)
+        untracked = Product.objects.create(category=category, name='Untracked', slug='untracked', price=10)
+        order_id = set_cart_item(user.pk, untracked.pk, 50)
+        set_cart_item(user.pk, tracked.pk, 4)
+
+        client = APIClient()
+        client.force_authenticate(user)
+        address = {field: 'Somewhere' for field in ('first_name', 'last_name', 'email', 'phone', 'address', 'city', 'state', 'country')}
+        response = client.post(reverse('orders_create'), {'order_id': order_id, 'shipping_address': address}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['data'], [tracked.pk])
+        self.assertEqual(Order.objects.get(id=order_id).status, IN_CART)
+
+        set_cart_item(user.pk, tracked.pk, 3)
+        response = client.post(reverse('orders_create'), {'order_id': order_id, 'shipping_address': address}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Product.objects.get(id=tracked.pk).stock, 0)
+        self.assertEqual(Order.objects.get(id=order_id).status, ORDER_PLACED)
+
+
+class IdempotencyKeyTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000000', password='secret')
+        cls.products = create_catalog()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_retried_checkout_is_replayed(self):
+        order_id = set_cart_item(self.user.pk, self.products[0].pk, 1)
+        address = {field: 'Somewhere' for field in ('first_name', 'last_name', 'email', 'phone', 'address', 'city', 'state', 'country')}
+        body = {'order_id': order_id, 'shipping_address': address}
+        first = self.client.post(reverse('orders_create'), body, format='json', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(first.status_code, 200)
+
+        # the stored response comes back with the claim attempt
+        with max_queries(1):
+            retry = self.client.post(reverse('orders_create'), body, format='json', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual((retry.status_code, retry.data), (200, first.data))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(OrderDelivery.objects.filter(order_id=order_id).count(), 1)
+
+        body['shipping_address'] = dict(address, city='Elsewhere')
+        response = self.client.post(reverse('orders_create'), body, format='json', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(response.status_code, 422)
+
+    def test_marker_of_dead_request_expires(self):
+        body = {'product_id': self.products[0].pk, 'quantity': 2}
+        # the worker dies after the cart write: the response is never stored nor the key freed
+        with mock.patch('config.idempotency.release'):
+            self.client.post(reverse('orders_in_cart'), body, format='json', HTTP_IDEMPOTENCY_KEY='lost')
+        retry = self.client.post(reverse('orders_in_cart'), body, format='json', HTTP_IDEMPOTENCY_KEY='lost')
+        self.assertEqual(retry.status_code, 409)
+
+        later = timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_IN_PROGRESS_TIMEOUT + 1)
+        with mock.patch('config.idempotency.timezone.now', return_value=later):
+            retry = self.client.post(reverse('orders_in_cart'), body, format='json', HTTP_IDEMPOTENCY_KEY='lost')
+        self.assertLess(retry.status_code, 300)
+        self.assertNotIn('Idempotent-Replayed', retry)
+
+    def test_expired_keys_purged(self):
+        body = {'product_id': self.products[0].pk, 'quantity': 2}
+        self.client.post(reverse('orders_in_cart'), body, format='json', HTTP_IDEMPOTENCY_KEY='old')
+        self.client.post(reverse('orders_in_cart'), body, format='json', HTTP_IDEMPOTENCY_KEY='new')
+        IdempotencyKey.objects.filter(id=IdempotencyKey.objects.order_by('id').first().id).update(expires=timezone.now())
+
+        out = StringIO()
+        call_command('purge_idempotency_keys', batch_size=1, stdout=out)
+        self.assertIn('Deleted 1 expired idempotency keys', out.getvalue())
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_key_scoped_to_endpoint(self):
+        body = {'product_id': self.products[0].pk, 'quantity': 2}
+        self.client.post(reverse('orders_in_cart'), body, format='json', HTTP_IDEMPOTENCY_KEY='key')
+        response = self.client.post(reverse('orders_cart_batch'), {'operations': [
+            {'action': 'increment', 'product_id': self.products[0].pk, 'quantity': 1},
+        ]}, format='json', HTTP_IDEMPOTENCY_KEY='key')
+        self.assertEqual(response.data['data'][0]['quantity'], 3)
+
+
+class PurgeAbandonedCartsTest(TestCase):
+
+    def test_purges_idle_carts_only(self):
+        products = create_catalog()
+        users = [
+            User.objects.create_user(f'buyer{i}@example.com', 'Buyer', 'Example', f'0800000000{i}', password='secret')
+            for i in range(5)
+        ]
+        order_ids = [set_cart_item(user.pk, products[0].pk, 1) for user in users]
+        Order.objects.filter(id__in=order_ids[:3]).update(updated=timezone.now() - timedelta(days=40))
+        placed = Order.objects.create(user=users[0], status=ORDER_PLACED, meta='')
+        Order.objects.filter(id=placed.id).update(updated=timezone.now() - timedelta(days=40))
+
+        out = StringIO()
+        call_command('purge_abandoned_carts', ttl_days=30, batch_size=2, stdout=out)
+        self.assertIn('Deleted 3 carts and 3 cart items', out.getvalue())
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)), {*order_ids[3:], placed.id})
+
+
+class OrderTransitionTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff@example.com', 'Staff', 'Example', '08000000000', password='secret')
+        cls.staff.is_staff = True
+        cls.staff.save()
+        cls.product = create_catalog(1)[0]
+        cls.product.stock = 0
+        cls.product.save()
+
+    def test_bulk_transition_with_audit_log(self):
+        placed = Order.objects.bulk_create([Order(user=self.staff, status=ORDER_PLACED, meta='') for _ in range(5)])
+        delivered = Order.objects.create(user=self.staff, status=ORDER_DELIVERED, meta='')
+        ids = [order.id for order in placed] + [delivered.id]
+
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        # savepoint, one UPDATE for the only source status, one INSERT for the log, release
+        with max_queries(4):
+            response = client.post(reverse('orders_transitions'), {'order_ids': ids, 'status': ORDER_DISPATCHED}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data'], {'updated': sorted(order.id for order in placed), 'skipped': [delivered.id]})
+        self.assertEqual(Order.objects.filter(status=ORDER_DISPATCHED).count(), 5)
+        self.assertEqual(
+            set(OrderStatusLog.objects.values_list('from_status', 'to_status', 'actor')),
+            {(ORDER_PLACED, ORDER_DISPATCHED, self.staff.id)}
+        )
+
+    def test_cancel_restocks(self):
+        order = Order.objects.create(user=self.staff, status=ORDER_PLACED, meta='')
+        OrderItem.objects.create(order=order, product=self.product, price=self.product.price, quantity=2)
+        transition_orders([order.id], ORDER_CANCELED)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.available), (2, True))
+
+        moved, skipped = transition_orders([order.id], ORDER_DISPATCHED)
+        self.assertEqual((moved, skipped), ([], [order.id]))
+
+    def test_transitions_are_staff_only(self):
+        customer = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000001', password='secret')
+        client = APIClient()
+        client.force_authenticate(customer)
+        response = client.post(reverse('orders_transitions'), {'order_ids': [1], 'status': ORDER_DISPATCHED}, format='json')
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,72 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from orders.models import (ORDER_CANCELED, ORDER_DELIVERED, ORDER_DISPATCHED, ORDER_PLACED, ORDER_RETURNED,
+                           Order, OrderItem, OrderStatusLog)
+from shop.cache import bump_catalog_version
+from shop.models import Category, Product
+
+# allowed moves, checkout (IN_CART -> ORDER_PLACED) goes through OrdersCreateView instead
+TRANSITIONS = {
+    ORDER_PLACED: (ORDER_DISPATCHED, ORDER_CANCELED),
+    ORDER_DISPATCHED: (ORDER_DELIVERED, ORDER_RETURNED),
+    ORDER_DELIVERED: (ORDER_RETURNED,),
+}
+
+# cancelling an order puts its reserved stock back
+RESTOCKED_STATUSES = (ORDER_CANCELED,)
+
+
+def sources_of(target):
+    return [source for source, targets in TRANSITIONS.items() if target in targets]
+
+
+@transaction.atomic
+def transition_orders(order_ids, target, actor=None):
+    """
+    Moves the given orders to `target` and returns `(moved_ids, skipped_ids)`.
+
+    Runs one UPDATE per allowed source status, so thousands of orders cost a handful
+    of statements, then writes the audit log with a single `bulk_create`. Orders that
+    can't move to `target` from their current status are skipped.
+    """
+    order_ids = list(set(order_ids))
+    now = timezone.now()
+    moved = {}
+    with connection.cursor() as cursor:
+        for source in sources_of(target):
+            cursor.execute(
+                f'UPDATE {Order._meta.db_table} SET status = %s, updated = %s '
+                f'WHERE id = ANY(%s) AND status = %s RETURNING id',
+                [target, now, order_ids, source]
+            )
+            moved.update((order_id, source) for order_id, in cursor.fetchall())
+
+    OrderStatusLog.objects.bulk_create([
+        OrderStatusLog(order_id=order_id, from_status=source, to_status=target, actor=actor)
+        for order_id, source in moved.items()
+    ], batch_size=1000)
+    if moved and target in RESTOCKED_STATUSES:
+        restock(list(moved))
+    return sorted(moved), sorted(set(order_ids) - set(moved))
+
+
+def restock(order_ids):
+    """Gives the items of the orders back to the stock of tracked products in one UPDATE"""
+    product_table = Product._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {product_table} p '
+            f'SET stock = p.stock + returned.quantity, available = p.available OR p.stock = 0 '
+            f'FROM ('
+            f'SELECT product_id, SUM(quantity) AS quantity FROM {OrderItem._meta.db_table} '
+            f'WHERE order_id = ANY(%s) GROUP BY product_id'
+            f') returned '
+            f'WHERE p.id = returned.product_id AND p.stock IS NOT NULL '
+            f'RETURNING p.category_id, p.stock = returned.quantity',
+            [order_ids]
+        )
+        back_in_stock = {category_id for category_id, was_sold_out in cursor.fetchall() if was_sold_out}
+    if back_in_stock:
+        Category.objects.refresh_product_counts(back_in_stock)
+        transaction.on_commit(bump_catalog_version)
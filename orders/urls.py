@@ -1,9 +1,12 @@
 from django.urls import path
-from orders.views import CartView, OrdersListView, OrdersDetailView, OrdersCreateView
+from orders.views import CartView, CartBatchView, OrdersListView, OrdersDetailView, OrderReceiptView, OrdersCreateView, OrdersTransitionView
 
 urlpatterns = [
     path("cart/", CartView.as_view(), name="orders_in_cart"),
+    path("cart/batch/", CartBatchView.as_view(), name="orders_cart_batch"),
     path("<int:id>/", OrdersDetailView.as_view(), name="orders_detail"),
+    path("receipt/<str:receipt_number>/", OrderReceiptView.as_view(), name="orders_receipt"),
     path("", OrdersListView.as_view(), name="orders_list"),
     path("pay/", OrdersCreateView.as_view(), name="orders_create"),
+    path("transitions/", OrdersTransitionView.as_view(), name="orders_transitions"),
 ]
@@ -1,55 +1,64 @@
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework import permissions
-from authentication.models import User
-from orders.models import Order, OrderItem, OrderDelivery, IN_CART, ORDER_PLACED, ORDER_CANCELED, ORDER_RETURNED, ORDER_DELIVERED, ORDER_DISPATCHED
-from orders.serializers import AddToCartSerializer, OrdersDetailSerializer, OrdersSerializer, OrdersDeliverySerializer
+from orders.models import SHIPPING_ADDRESS_FIELDS, Order, OrderItem, OrderDelivery, IN_CART, ORDER_PLACED, ORDER_CANCELED, ORDER_RETURNED, ORDER_DELIVERED, ORDER_DISPATCHED
+from orders.serializers import AddToCartSerializer, CartBatchSerializer, OrdersDetailSerializer, OrdersSerializer, OrdersDeliverySerializer, OrdersTransitionSerializer
 from shop.models import Product
+from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
+from config.idempotency import idempotent
+from orders.filters import OrderFilterBackend
+from orders.pagination import OrderHistoryPagination
+from orders.stock import OutOfStock, reserve_stock
+from orders.transitions import transition_orders
+from orders.cart import apply_cart_operations, set_cart_item
 
 class OrdersListView(generics.GenericAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = OrdersSerializer
-    # queryset = Order.objects.exclude(status=IN_CART)
+    pagination_class = OrderHistoryPagination
+    filter_backends = (OrderFilterBackend,)
+    query_budget = 1
+
+    def get_queryset(self):
+        fields = self.serializer_class.Meta.fields
+        return Order.objects.filter(user_id=self.request.user.pk).values(*fields)
 
     def get(self, request):
-        user = request.user
-        try:
-            user = User.objects.get(email=user)
-            order = Order.objects.filter(user=user).exclude(status=IN_CART)
-            order_data = []
-            if order.exists():
-                order_data = list(order.values())
-            return Response({
-                'status': 'Success', 
-                'message': f'Order listed succesfully', 
-                'data': order_data
-                }, status=status.HTTP_200_OK)
-        except:
-            return Response({
-                'status': 'Failed', 
-                'message': 'Unauthorized', 
-                'data': []
-                }, status=status.HTTP_401_UNAUTHORIZED)
+        orders = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        return Response({
+            'status': 'Success', 
+            'message': f'Order listed succesfully', 
+            'data': self.get_paginated_response(orders).data
+            }, status=status.HTTP_200_OK)
 
 
 class OrdersDetailView(generics.GenericAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = OrdersDetailSerializer
+    query_budget = 2
 
-    def get(self, request, id):
-        user = request.user
+    def get_order_filter(self, request, **kwargs):
+        return {'id': kwargs['id'], 'user_id': request.user.pk}
+
+    def get(self, request, **kwargs):
+        lookup = ', '.join(f'{key} {value}' for key, value in kwargs.items())
         try:
-            user = User.objects.get(email=user)
-            order = Order.objects.filter(id=id, user=user).first()
+            order = Order.objects.with_shipping_address().select_related('user__profile').filter(**self.get_order_filter(request, **kwargs)).first()
             if not order:
                 return Response({
                     'status': 'Failed', 
-                    'message': f'Order with id {id} not found', 
+                    'message': f'Order with {lookup} not found', 
                     'data': []
                 }, status=status.HTTP_404_NOT_FOUND)
-            order_items = list(OrderItem.objects.filter(order=order).values('product_id', 'product__name', 'price', 'quantity'))
-            order_shipping_address = order.shipping_address.all().first()
+            # `updated` moves whenever the items change, so a cached copy is never stale
+            cache_key = f'orders:items:{order.id}:{order.updated.timestamp()}'
+            order_items = cache.get(cache_key)
+            if order_items is None:
+                order_items = list(OrderItem.objects.filter(order=order).values('product_id', 'product__name', 'price', 'quantity'))
+                cache.set(cache_key, order_items, settings.ORDER_ITEMS_CACHE_TIMEOUT)
+            order_shipping_address = order.shipping or {}
             return Response({
                 'status': 'Success', 
                 'message': f'Order in cart loaded', 
@@ -59,7 +68,7 @@ class OrdersDetailView(generics.GenericAPIView):
                     "paid": order.paid,
                     "created": order.created,
                     "receipt_number": order.receipt_number,
-                    "order_cost": order.get_total_cost(),
+                    "order_cost": order.total,
                     "billing_address": {
                         "first_name": order.user.first_name,
                         "last_name": order.user.last_name,
@@ -71,14 +80,7 @@ class OrdersDetailView(generics.GenericAPIView):
                         "country": order.user.profile.country
                         },
                     "shipping_address": {
-                        "first_name": order_shipping_address.first_name if order_shipping_address else None,
-                        "last_name": order_shipping_address.last_name if order_shipping_address else None,
-                        "email": order_shipping_address.email if order_shipping_address else None,
-                        "phone": order_shipping_address.phone if order_shipping_address else None,
-                        "address": order_shipping_address.address if order_shipping_address else None,
-                        "city": order_shipping_address.city if order_shipping_address else None,
-                        "state": order_shipping_address.state if order_shipping_address else None,
-                        "country": order_shipping_address.country if order_shipping_address else None,
+                        field: order_shipping_address.get(field) for field in SHIPPING_ADDRESS_FIELDS
                     },
                     "order_items": order_items
                     }
@@ -91,6 +93,18 @@ class OrdersDetailView(generics.GenericAPIView):
                 'message': 'Unauthorized', 
                 'data': []
                 }, status=status.HTTP_401_UNAUTHORIZED)
+
+
+class OrderReceiptView(OrdersDetailView):
+    """Order lookup by receipt number; staff can look up any customer's order"""
+
+    def get_order_filter(self, request, **kwargs):
+        order_filter = {'receipt_number': kwargs['receipt_number']}
+        if not request.user.is_staff:
+            order_filter['user_id'] = request.user.pk
+        return order_filter
+
+
 class CartView(generics.GenericAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = AddToCartSerializer
@@ -98,8 +112,7 @@ class CartView(generics.GenericAPIView):
     def get(self, request):
         user = request.user
         try:
-            user = User.objects.get(email=user)
-            order = Order.objects.filter(user=user, status=IN_CART).first()
+            order = Order.objects.filter(user_id=user.pk, status=IN_CART).first()
             order_items = []
             if order:
                 order_items = list(OrderItem.objects.filter(order=order).values())
@@ -114,7 +127,7 @@ class CartView(generics.GenericAPIView):
                 'message': 'Unauthorized', 
                 'data': []
                 }, status=status.HTTP_401_UNAUTHORIZED)
-    @transaction.atomic
+    @idempotent
     def post(self, request):
         user = request.user
 
@@ -123,31 +136,8 @@ class CartView(generics.GenericAPIView):
         product_id = request.data.get('product_id')
         quantity = request.data.get('quantity')
         try:
-            product = Product.objects.get(id=product_id)
-            user = User.objects.get(email=user)
-            order = Order.objects.filter(user=user, status=IN_CART).first()
-            if not order:
-                # create new order
-                order = Order.objects.create(
-                    user=user,
-                    status=IN_CART,
-                    paid=False,
-                    meta=""
-                )
-            # create or update order item
-            # check if product already exists in cart
-            if order.items.filter(product=product).exists():
-                # update order in cart
-                order_item = order.items.filter(product=product).first()
-                order_item.quantity = quantity
-                order_item.save()
-            else:
-                order_item = OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    price=product.price,
-                    quantity=quantity
-                )
+            # upserts the cart and the item, so parallel requests can't duplicate either
+            set_cart_item(user.pk, product_id, quantity)
             return Response({
                 'status': 'Success', 
                 'message': 'Cart updated successfully', 
@@ -172,15 +162,15 @@ class CartView(generics.GenericAPIView):
         product_id = self.request.query_params.get("product_id")
         message = None
         try:
-            user = User.objects.get(email=user)
             if product_id is not None:
                 product = Product.objects.get(id=product_id)
-                order_in_cart = Order.objects.filter(status=IN_CART, user=user).first()
+                order_in_cart = Order.objects.filter(status=IN_CART, user_id=user.pk).first()
                 order_item = order_in_cart.items.filter(product=product).first()
                 order_item.delete()
+                Order.objects.refresh_totals([order_in_cart.id])
                 message = f'{product.name} deleted from cart'
             else:
-                order_in_cart = Order.objects.filter(status=IN_CART, user=user).first()
+                order_in_cart = Order.objects.filter(status=IN_CART, user_id=user.pk).first()
                 order_in_cart.delete()
             return Response({
                 'status': 'Success', 
@@ -201,11 +191,44 @@ class CartView(generics.GenericAPIView):
                 }, status=status.HTTP_401_UNAUTHORIZED)
 
 
+class CartBatchView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = CartBatchSerializer
+
+    @idempotent
+    def post(self, request):
+        user = request.user
+
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            order_id = apply_cart_operations(user.pk, serializer.validated_data['operations'])
+            order_items = list(OrderItem.objects.filter(order_id=order_id).values())
+            return Response({
+                'status': 'Success', 
+                'message': 'Cart updated successfully', 
+                'data': order_items
+                }, status=status.HTTP_200_OK)
+        except Product.DoesNotExist as error:
+            return Response({
+                'status': 'Failed', 
+                'message': str(error), 
+                'data': []
+                }, status=status.HTTP_404_NOT_FOUND)
+        except:
+            return Response({
+                'status': 'Failed', 
+                'message': 'Unauthorized', 
+                'data': []
+                }, status=status.HTTP_401_UNAUTHORIZED)
+
+
 class OrdersCreateView(generics.GenericAPIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     serializer_class = OrdersDeliverySerializer
 
+    @idempotent
     @transaction.atomic
     def post(self, request):
         user = request.user
@@ -215,16 +238,24 @@ class OrdersCreateView(generics.GenericAPIView):
         order_id = request.data.get('order_id')
         shipping_address = request.data.get('shipping_address')
         try:
-            user = User.objects.get(email=user)
-            order = Order.objects.filter(id=order_id, user=user, status=IN_CART)
-            if not order.exists():
+            # locks the cart, a concurrent checkout of the same order waits here and then finds it placed
+            order = Order.objects.select_for_update().filter(id=order_id, user_id=user.pk, status=IN_CART).first()
+            if not order:
                 return Response({
                 'status': 'Failed', 
                 'message': f'Order with id {order_id} not found', 
                 'data': []
                 }, status=status.HTTP_404_NOT_FOUND)
 
-            order = Order.objects.filter(id=order_id, user=user, status=IN_CART).first()
+            try:
+                reserve_stock(order.id)
+            except OutOfStock as error:
+                return Response({
+                'status': 'Failed', 
+                'message': str(error), 
+                'data': error.product_ids
+                }, status=status.HTTP_409_CONFLICT)
+
             order.status = ORDER_PLACED
             order.save()
 
@@ -257,3 +288,22 @@ class OrdersCreateView(generics.GenericAPIView):
                 'data': []
                 }, status=status.HTTP_401_UNAUTHORIZED)
 
+
+class OrdersTransitionView(generics.GenericAPIView):
+    """Moves many orders to a new status at once, staff only"""
+    permission_classes = (permissions.IsAdminUser,)
+    serializer_class = OrdersTransitionSerializer
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        target = serializer.validated_data['status']
+        moved, skipped = transition_orders(serializer.validated_data['order_ids'], target, actor=request.user)
+        return Response({
+            'status': 'Success', 
+            'message': f'{len(moved)} orders moved to {target}', 
+            'data': {
+                'updated': moved,
+                'skipped': skipped
+                }
+            }, status=status.HTTP_200_OK)
@@ -7,7 +7,7 @@ class ProductImageInline(admin.TabularInline):
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug']
+    list_display = ['name', 'slug', 'product_count', 'available_product_count']
     prepopulated_fields = {'slug': ('name',)}
 
 
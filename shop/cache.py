@@ -0,0 +1,59 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = 'shop:catalog:version'
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # start from the clock so a lost key can never bring back an old version
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(CATALOG_VERSION_KEY, version, timeout=None)
+        return version
+
+
+class CatalogCacheMixin:
+    """
+    Caches the serialized data of successful GET responses.
+
+    Entries are keyed by host, path, query params and the catalog version, so bumping
+    the version (done by the signals in `shop.signals`) invalidates every page at once.
+    Only use it on views whose output doesn't depend on the requesting user.
+    Off without `SHARED_CACHE`, as a version bumped by one process would leave the
+    pages cached by the others stale.
+    """
+    cache_timeout = settings.CATALOG_CACHE_TIMEOUT
+
+    def get_cache_key(self, request):
+        params = urlencode(sorted(request.query_params.lists()), doseq=True)
+        raw = f'{request.get_host()}{request.path}?{params}'
+        digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+        return f'shop:response:{get_catalog_version()}:{digest}'
+
+    def get(self, request, *args, **kwargs):
+        if not settings.SHARED_CACHE:
+            return super().get(request, *args, **kwargs)
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, self.cache_timeout)
+        return response
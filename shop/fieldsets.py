@@ -0,0 +1,78 @@
+from rest_framework.exceptions import ValidationError
+
+
+class SparseFieldsSerializerMixin:
+    """
+    Drops every field not listed in the `fields` entry of the serializer context.
+
+    `field_dependencies` maps fields that don't read a single model attribute
+    (e.g. method fields) to the model field paths they need. Fields can also
+    declare them themselves with a `model_fields` attribute.
+    """
+    field_dependencies = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.context.get('fields')
+        if requested:
+            for name in set(self.fields) - set(requested):
+                self.fields.pop(name)
+
+    def get_model_fields(self):
+        """Model field paths (`category__name`) read by the remaining fields"""
+        paths = set()
+        for name, field in self.fields.items():
+            if name in self.field_dependencies:
+                paths.update(self.field_dependencies[name])
+            elif getattr(field, 'model_fields', None):
+                paths.update(field.model_fields)
+            elif field.source != '*':
+                paths.add(field.source.replace('.', '__'))
+        return paths
+
+
+class SparseFieldsetMixin:
+    """
+    `?fields=id,name,price` projection for generic views.
+
+    The requested fields drive both the serializer field set and `.only()` on the
+    queryset, so columns the client doesn't render are never read from the database.
+    """
+    fields_query_param = 'fields'
+    available_fields = None
+
+    def get_available_fields(self):
+        if self.available_fields is not None:
+            return self.available_fields
+        return list(self.get_serializer_class()().fields)
+
+    def get_requested_fields(self):
+        if not hasattr(self, '_requested_fields'):
+            request = getattr(self, 'request', None)
+            value = request.query_params.get(self.fields_query_param, '') if request else ''
+            requested = [name.strip() for name in value.split(',') if name.strip()]
+            unknown = set(requested) - set(self.get_available_fields())
+            if unknown:
+                raise ValidationError({self.fields_query_param: f'Unknown fields: {", ".join(sorted(unknown))}'})
+            self._requested_fields = requested
+        return self._requested_fields
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_requested_fields()
+        return context
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if not self.get_requested_fields():
+            return queryset
+
+        paths = self.get_serializer().get_model_fields()
+        paths.add(queryset.model._meta.pk.name)
+        # keyset pagination reads its ordering fields from every row
+        paths.update(field.lstrip('-') for field in getattr(self.paginator, 'ordering', ()) or ())
+        related = {path.split('__')[0] for path in paths if '__' in path}
+        queryset = queryset.select_related(None)
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*paths, *related)
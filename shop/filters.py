@@ -0,0 +1,206 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Case, Count, IntegerField, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from shop.search import search_products
+
+TRUE_VALUES = ('1', 'true', 'yes')
+FALSE_VALUES = ('0', 'false', 'no')
+
+
+class ProductFilterBackend(BaseFilterBackend):
+    """
+    Filters products by `category` (comma separated ids or slugs), `min_price`,
+    `max_price`, `available` and `created_after`/`created_before`.
+    """
+    params = {
+        'category': 'Comma separated category ids or slugs',
+        'min_price': 'Minimum price, inclusive',
+        'max_price': 'Maximum price, inclusive',
+        'available': 'true or false',
+        'created_after': 'Date or datetime, inclusive',
+        'created_before': 'Date or datetime, inclusive',
+        'facets': 'Set to true to add facet counts to the response',
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        categories = [value for value in params.get('category', '').split(',') if value]
+        if categories:
+            if all(value.isdigit() for value in categories):
+                queryset = queryset.filter(category_id__in=categories)
+            else:
+                queryset = queryset.filter(category__slug__in=categories)
+
+        min_price = self.parse_price(params, 'min_price')
+        if min_price is not None:
+            queryset = queryset.filter(price__gte=min_price)
+        max_price = self.parse_price(params, 'max_price')
+        if max_price is not None:
+            queryset = queryset.filter(price__lte=max_price)
+
+        available = params.get('available', '').lower()
+        if available in TRUE_VALUES:
+            queryset = queryset.filter(available=True)
+        elif available in FALSE_VALUES:
+            queryset = queryset.filter(available=False)
+
+        return self.filter_created(queryset, params)
+
+    def filter_created(self, queryset, params):
+        """Dates become datetime bounds, so the range stays on an index of the `created` column"""
+        created_after = self.parse_created(params, 'created_after')
+        if created_after is not None:
+            queryset = queryset.filter(created__gte=self.start_of(created_after))
+        created_before = self.parse_created(params, 'created_before')
+        if created_before is not None:
+            if hasattr(created_before, 'hour'):
+                queryset = queryset.filter(created__lte=self.start_of(created_before))
+            else:
+                queryset = queryset.filter(created__lt=self.start_of(created_before + timedelta(days=1)))
+        return queryset
+
+    def start_of(self, value):
+        if not hasattr(value, 'hour'):
+            value = datetime.combine(value, time.min)
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    def parse_price(self, params, name):
+        value = params.get(name)
+        if not value:
+            return None
+        try:
+            return Decimal(value)
+        except InvalidOperation:
+            raise ValidationError({name: 'A valid number is required.'})
+
+    def parse_created(self, params, name):
+        value = params.get(name)
+        if not value:
+            return None
+        try:
+            parsed = parse_datetime(value) or parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError({name: 'A valid date or datetime is required.'})
+        return parsed
+
+    def get_schema_fields(self, view):
+        assert coreapi is not None, 'coreapi must be installed to use `get_schema_fields()`'
+        assert coreschema is not None, 'coreschema must be installed to use `get_schema_fields()`'
+        return [
+            coreapi.Field(
+                name=name,
+                required=False,
+                location='query',
+                schema=coreschema.String(description=description)
+            )
+            for name, description in self.params.items()
+        ]
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': name,
+                'required': False,
+                'in': 'query',
+                'description': description,
+                'schema': {
+                    'type': 'string',
+                },
+            }
+            for name, description in self.params.items()
+        ]
+
+
+class ProductSearchFilterBackend(BaseFilterBackend):
+    """Full text `search` over name and description, ordered by relevance"""
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param)
+        if not query:
+            return queryset
+        return search_products(queryset, query)
+
+    def get_schema_fields(self, view):
+        assert coreapi is not None, 'coreapi must be installed to use `get_schema_fields()`'
+        assert coreschema is not None, 'coreschema must be installed to use `get_schema_fields()`'
+        return [
+            coreapi.Field(
+                name=self.search_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(description='Search products by name and description')
+            )
+        ]
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.search_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Search products by name and description',
+                'schema': {
+                    'type': 'string',
+                },
+            },
+        ]
+
+
+def facets_requested(request):
+    return request.query_params.get('facets', '').lower() in TRUE_VALUES
+
+
+def product_facets(queryset):
+    """
+    Counts `queryset` per category, price bucket and availability.
+
+    A single GROUP BY over the three dimensions is rolled up in Python,
+    so the database is only hit once whatever the number of facets.
+    """
+    bounds = settings.PRODUCT_PRICE_BUCKETS
+    price_bucket = Case(
+        *[When(price__lt=bound, then=Value(index)) for index, bound in enumerate(bounds)],
+        default=Value(len(bounds)),
+        output_field=IntegerField()
+    )
+    rows = (
+        queryset.order_by()
+        .annotate(price_bucket=price_bucket)
+        .values('category_id', 'category__name', 'available', 'price_bucket')
+        .annotate(total=Count('id'))
+    )
+
+    categories, prices, available = {}, [0] * (len(bounds) + 1), {'true': 0, 'false': 0}
+    for row in rows:
+        category = categories.setdefault(row['category_id'], {
+            'id': row['category_id'],
+            'name': row['category__name'],
+            'count': 0,
+        })
+        category['count'] += row['total']
+        prices[row['price_bucket']] += row['total']
+        available['true' if row['available'] else 'false'] += row['total']
+
+    edges = [None, *bounds, None]
+    return {
+        'category': sorted(categories.values(), key=lambda category: category['name']),
+        'price': [
+            {'min': edges[index], 'max': edges[index + 1], 'count': count}
+            for index, count in enumerate(prices)
+        ],
+        'available': available,
+    }
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from config.images import refresh_variants
+from shop.cache import bump_catalog_version
+from shop.models import Category, Product, ProductImage
+
+MODELS = (Category, Product, ProductImage, Post)
+
+
+class Command(BaseCommand):
+    help = 'Generates the responsive variants of new or replaced images, and deletes the ones they replace'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new uploads instead of exiting once done')
+        parser.add_argument('--interval', type=float, default=10, help='Seconds to sleep between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            refreshed = self.refresh_all(options)
+            if refreshed:
+                bump_catalog_version()
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
+
+    def refresh_all(self, options):
+        total = 0
+        for model in MODELS:
+            refreshed = 0
+            for field_name, variants_field in model.image_variants_fields:
+                queryset = model.objects.filter(**{f'{variants_field}_stale': True}).only('pk', field_name, variants_field)
+                for instance in queryset.order_by('pk').iterator(chunk_size=options['batch_size']):
+                    refreshed += refresh_variants(instance, field_name, variants_field)
+            if refreshed or not options['loop']:
+                self.stdout.write(f'{model.__name__}: {refreshed} refreshed')
+            total += refreshed
+        return total
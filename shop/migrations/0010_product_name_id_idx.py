@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_auto_20221018_1349'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='shop_product_name_id_idx'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 3.2.16 on 2026-10-18 08:46
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def copy_recent_products(apps, schema_editor):
+    """Keeps the latest entries of each user, in the order they were first added"""
+    Product = apps.get_model('shop', 'Product')
+    RecentlyViewed = apps.get_model('shop', 'RecentlyViewed')
+    Through = Product.user_recent.through
+    limit = getattr(settings, 'RECENTLY_VIEWED_LIMIT', 20)
+    now = django.utils.timezone.now()
+
+    by_user = {}
+    for user_id, product_id in Through.objects.order_by('id').values_list('user_id', 'product_id').iterator():
+        by_user.setdefault(user_id, []).append(product_id)
+
+    entries = []
+    for user_id, product_ids in by_user.items():
+        latest = product_ids[-limit:]
+        for age, product_id in enumerate(reversed(latest)):
+            entries.append(RecentlyViewed(
+                user_id=user_id,
+                product_id=product_id,
+                viewed_at=now - datetime.timedelta(seconds=age)
+            ))
+    RecentlyViewed.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('shop', '0010_product_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecentlyViewed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('viewed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recent_views', to='shop.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recently_viewed', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'recently viewed',
+                'ordering': ('-viewed_at',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='recentlyviewed',
+            index=models.Index(fields=['user', '-viewed_at'], name='shop_recent_user_viewed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='recentlyviewed',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='shop_recentlyviewed_user_product'),
+        ),
+        migrations.RunPython(copy_recent_products, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='product',
+            name='user_recent',
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.2.16 on 2026-10-18 08:49
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce({row}name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce({row}description, '')), 'B')"
+)
+
+CREATE_TRIGGER = f'''
+CREATE FUNCTION shop_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR.format(row='NEW.')};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER shop_product_search_vector_trigger
+BEFORE INSERT OR UPDATE OF name, description ON shop_product
+FOR EACH ROW EXECUTE PROCEDURE shop_product_search_vector_update();
+
+UPDATE shop_product SET search_vector = {SEARCH_VECTOR.format(row='')};
+'''
+
+DROP_TRIGGER = '''
+DROP TRIGGER shop_product_search_vector_trigger ON shop_product;
+DROP FUNCTION shop_product_search_vector_update();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_product_filter_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='shop_prod_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='shop_prod_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
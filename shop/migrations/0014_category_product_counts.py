@@ -0,0 +1,36 @@
+# Generated by Django 3.2.16 on 2026-10-18 08:51
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_products(apps, schema_editor):
+    Category = apps.get_model('shop', 'Category')
+    Product = apps.get_model('shop', 'Product')
+    products = Product.objects.filter(category=OuterRef('pk')).order_by().values('category')
+    Category.objects.update(
+        product_count=Coalesce(Subquery(products.annotate(total=Count('id')).values('total')), 0),
+        available_product_count=Coalesce(Subquery(products.filter(available=True).annotate(total=Count('id')).values('total')), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='available_product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.16 on 2026-10-18 09:43
+
+from django.db import migrations, models
+from django.db.models import F, Q
+from django.db.models.fields.json import KeyTextTransform
+
+
+def flag(model, field_name, variants_field):
+    """Flags the rows whose variants don't match their image, as the worker used to find them"""
+    source = KeyTextTransform('source', variants_field)
+    has_image = ~Q(**{field_name: ''}) & Q(**{f'{field_name}__isnull': False})
+    outdated = Q(_source__isnull=True) | ~Q(_source=F(field_name))
+    leftover = ~has_image & ~Q(**{variants_field: {}})
+    model.objects.alias(_source=source).filter((has_image & outdated) | leftover).update(**{f'{variants_field}_stale': True})
+
+
+def flag_stale_variants(apps, schema_editor):
+    flag(apps.get_model('shop', 'Category'), 'image', 'image_variants')
+    flag(apps.get_model('shop', 'Product'), 'image', 'image_variants')
+    flag(apps.get_model('shop', 'ProductImage'), 'other_image', 'other_image_variants')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_product_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='image_variants_stale',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants_stale',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='other_image_variants_stale',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(condition=models.Q(('image_variants_stale', True)), fields=['id'], name='shop_cat_variants_stale_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('image_variants_stale', True)), fields=['id'], name='shop_prod_variants_stale_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productimage',
+            index=models.Index(condition=models.Q(('other_image_variants_stale', True)), fields=['id'], name='shop_img_variants_stale_idx'),
+        ),
+        migrations.RunPython(flag_stale_variants, migrations.RunPython.noop),
+    ]
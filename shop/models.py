@@ -1,46 +1,192 @@
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connection, models
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from authentication.models import User
+from config.images import ImageVariantsMixin
 
 # Create your models here.
-class Category(models.Model):
+class CategoryManager(models.Manager):
+
+    def adjust_product_counts(self, deltas):
+        """Adds `{category_id: (products, available_products)}` to the counts, without recounting"""
+        for category_id in sorted(deltas):
+            total, available = deltas[category_id]
+            if total or available:
+                self.filter(id=category_id).update(
+                    product_count=F('product_count') + total,
+                    available_product_count=F('available_product_count') + available
+                )
+
+    def refresh_product_counts(self, category_ids):
+        """Recounts the products of the given categories in a single UPDATE"""
+        products = Product.objects.filter(category=OuterRef('pk')).order_by().values('category')
+        total = products.annotate(total=Count('id')).values('total')
+        available = products.filter(available=True).annotate(total=Count('id')).values('total')
+        return self.filter(id__in=category_ids).update(
+            product_count=Coalesce(Subquery(total), 0),
+            available_product_count=Coalesce(Subquery(available), 0)
+        )
+
+
+class Category(ImageVariantsMixin, models.Model):
     name = models.CharField(max_length=255, db_index=True)
     slug = models.SlugField(max_length=255, unique=True)
     image = models.ImageField(upload_to='toyosi-assets/images/categories/', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image_variants_stale = models.BooleanField(default=False, editable=False)
+    # maintained by shop.signals whenever a product is saved or deleted
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+    available_product_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CategoryManager()
 
     class Meta:
         ordering = ('name',)
         verbose_name = 'category'
         verbose_name_plural = 'categories'
+        indexes = [
+            models.Index(fields=['id'], condition=Q(image_variants_stale=True), name='shop_cat_variants_stale_idx'),
+        ]
     
     def __str__(self):
         return self.name
 
 
-class Product(models.Model):
+class Product(ImageVariantsMixin, models.Model):
     category = models.ForeignKey(Category, related_name='products', on_delete=models.CASCADE)
     name = models.CharField(max_length=255, db_index=True)
     slug = models.SlugField(max_length=255, db_index=True)
     image = models.ImageField(upload_to='toyosi-assets/images/products/%Y/%m/%d', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image_variants_stale = models.BooleanField(default=False, editable=False)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=20, decimal_places=2)
     available = models.BooleanField(default=True)
+    # units left, or null when stock isn't tracked; reserved at checkout, see orders/stock.py
+    stock = models.PositiveIntegerField(null=True, blank=True)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    # weighted name (A) and description (B), kept up to date by a database trigger
+    search_vector = SearchVectorField(null=True, editable=False)
 
     user_favorites = models.ManyToManyField(User, related_name='saved_products', blank=True)
-    user_recent = models.ManyToManyField(User, related_name="recent_products", blank=True)
 
     class Meta:
         ordering = ('name',)
         index_together = (('id', 'slug'),)
+        indexes = [
+            models.Index(fields=['name', 'id'], name='shop_product_name_id_idx'),
+            models.Index(fields=['category', 'name', 'id'], name='shop_prod_cat_name_id_idx'),
+            models.Index(fields=['category', 'available', 'price'], name='shop_prod_cat_avail_price_idx'),
+            models.Index(fields=['available', 'price'], name='shop_prod_avail_price_idx'),
+            models.Index(fields=['created'], name='shop_prod_created_idx'),
+            GinIndex(fields=['search_vector'], name='shop_prod_search_vector_idx'),
+            GinIndex(fields=['name'], name='shop_prod_name_trgm_idx', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['id'], condition=Q(image_variants_stale=True), name='shop_prod_variants_stale_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.stock == 0:
+            self.available = False
+        elif self.stock and self.restocked():
+            # undo what selling out did, as the order transitions do for returned stock
+            self.available = True
+        super().save(*args, **kwargs)
+        self._loaded_stock = self.stock
+
+    def restocked(self):
+        """Stock goes up from 0 and `available` wasn't edited along with it"""
+        loaded_available = getattr(self, '_loaded_available', None)
+        return getattr(self, '_loaded_stock', None) == 0 and loaded_available is False and not self.available
 
-class ProductImage(models.Model):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # lets the product count signals and `restocked` compare with what is stored
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        instance._loaded_available = instance.__dict__.get('available')
+        instance._loaded_stock = instance.__dict__.get('stock')
+        return instance
+
+
+class ProductImage(ImageVariantsMixin, models.Model):
     product = models.ForeignKey(Product, related_name='product_image', on_delete=models.CASCADE)
     other_image = models.ImageField(upload_to='toyosi-assets/images/products/%Y/%m/%d', null=True, blank=True)
+    other_image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    other_image_variants_stale = models.BooleanField(default=False, editable=False)
     image_description = models.CharField(max_length=63, null=True, blank=True)
 
+    image_variants_fields = (('other_image', 'other_image_variants'),)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=Q(other_image_variants_stale=True), name='shop_img_variants_stale_idx'),
+        ]
+
+
+class RecentlyViewedManager(models.Manager):
+
+    def record(self, views):
+        """
+        Upserts `{(user_id, product_id): viewed_at}` in one statement, then keeps only
+        the latest `RECENTLY_VIEWED_LIMIT` entries of each user involved.
+        """
+        if not views:
+            return
+        table = self.model._meta.db_table
+        rows = ', '.join(['(%s::bigint, %s::bigint, %s::timestamptz)'] * len(views))
+        params = [value for (user_id, product_id), viewed_at in views.items() for value in (user_id, product_id, viewed_at)]
+        with connection.cursor() as cursor:
+            # the joins drop views of products or users deleted since they were recorded
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, product_id, viewed_at) '
+                f'SELECT v.user_id, v.product_id, v.viewed_at FROM (VALUES {rows}) AS v (user_id, product_id, viewed_at) '
+                f'JOIN {Product._meta.db_table} p ON p.id = v.product_id '
+                f'JOIN {User._meta.db_table} u ON u.id = v.user_id '
+                f'ON CONFLICT (user_id, product_id) DO UPDATE '
+                f'SET viewed_at = GREATEST({table}.viewed_at, EXCLUDED.viewed_at)',
+                params
+            )
+        self.trim({user_id for user_id, _ in views})
+
+    def trim(self, user_ids, limit=None):
+        limit = limit or settings.RECENTLY_VIEWED_LIMIT
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE id IN ('
+                f'SELECT id FROM ('
+                f'SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY viewed_at DESC) AS position '
+                f'FROM {table} WHERE user_id = ANY(%s)'
+                f') ranked WHERE position > %s)',
+                [list(user_ids), limit]
+            )
+
+
+class RecentlyViewed(models.Model):
+    user = models.ForeignKey(User, related_name='recently_viewed', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='recent_views', on_delete=models.CASCADE)
+    viewed_at = models.DateTimeField(default=timezone.now)
+
+    objects = RecentlyViewedManager()
+
+    class Meta:
+        ordering = ('-viewed_at',)
+        verbose_name_plural = 'recently viewed'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='shop_recentlyviewed_user_product'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-viewed_at'], name='shop_recent_user_viewed_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product} viewed by {self.user}'
@@ -0,0 +1,218 @@
+import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Field, Func, Value
+from django.urls import reverse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class Row(Func):
+    """SQL row value, so `(name, id) > (%s, %s)` can use a composite index"""
+    template = '(%(expressions)s)'
+    output_field = Field()
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Keeps the microseconds of datetimes, which `DjangoJSONEncoder` truncates"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on the values of a unique `ordering`.
+
+    Each page is a single index range scan (`WHERE (a, b) > (x, y) ORDER BY a, b LIMIT n`),
+    so deep pages cost the same as the first one. All `ordering` fields must share
+    the same direction and the last one must be unique (usually `id`).
+    The total count is only computed when the client asks for it with `?count=true`.
+    """
+    ordering = ('id',)
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+    encoder_class = CursorEncoder
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = self.get_base_url(request, view)
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        if self.count_requested(request):
+            self.count = queryset.count()
+
+        position, reverse = self.decode_cursor(request, queryset.model)
+        descending = self.ordering[0].startswith('-')
+        fields = [field.lstrip('-') for field in self.ordering]
+        backwards = reverse != descending
+
+        if reverse:
+            order_by = [field if descending else f'-{field}' for field in fields]
+        else:
+            order_by = list(self.ordering)
+        queryset = queryset.order_by(*order_by)
+
+        if position is not None:
+            model = queryset.model
+            keyset = Row(*[F(field) for field in fields])
+            bound = Row(*[
+                Value(value, output_field=model._meta.get_field(field))
+                for field, value in zip(fields, position)
+            ])
+            lookup = 'lt' if backwards else 'gt'
+            queryset = queryset.alias(_keyset=keyset).filter(**{f'_keyset__{lookup}': bound})
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            first, last = self.get_position(results[0], fields), self.get_position(results[-1], fields)
+            if reverse:
+                self.next_position = last
+                self.previous_position = first if has_more else None
+            else:
+                self.next_position = last if has_more else None
+                self.previous_position = first if position is not None else None
+        return results
+
+    def get_base_url(self, request, view=None):
+        """The URL the next/previous links point to, with the cursor param swapped in"""
+        return request.build_absolute_uri()
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def count_requested(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes')
+
+    def get_position(self, item, fields):
+        if isinstance(item, dict):
+            return [item[field] for field in fields]
+        return [getattr(item, field) for field in fields]
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            position, reverse = json.loads(urlsafe_b64decode(padded.encode('ascii')))
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            # a tampered value would otherwise only fail in the database
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(reverse)
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps([position, reverse], cls=self.encoder_class, separators=(',', ':'))
+        encoded = urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, True)
+
+    def get_paginated_response(self, data):
+        body = OrderedDict()
+        if self.count is not None:
+            body['count'] = self.count
+        body['next'] = self.get_next_link()
+        body['previous'] = self.get_previous_link()
+        body['results'] = data
+        return Response(body)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {
+                    'type': 'integer',
+                    'example': 123,
+                },
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+
+class ProductCursorPagination(KeysetPagination):
+    """Opt-in with `?paginate=cursor`; the links it returns carry the `cursor` param"""
+    ordering = ('name', 'id')
+    opt_in_query_param = 'paginate'
+
+    @classmethod
+    def requested(cls, request):
+        if request is None:
+            return False
+        params = request.query_params
+        return params.get(cls.opt_in_query_param) == 'cursor' or cls.cursor_query_param in params
+
+    def encode_cursor(self, position, reverse):
+        url = super().encode_cursor(position, reverse)
+        return remove_query_param(url, self.opt_in_query_param)
+
+
+class CategoryProductsPagination(ProductCursorPagination):
+    """
+    First page of a category's products, continued through the product list.
+
+    The page is always the same, whatever the query params of the detail URL.
+    """
+    page_size = 20
+
+    def get_base_url(self, request, view=None):
+        url = reverse('products_list') + '?' + urlencode({'category': view.kwargs['pk'], 'limit': self.page_size})
+        return request.build_absolute_uri(url)
+
+    def get_page_size(self, request):
+        return self.page_size
+
+    def count_requested(self, request):
+        return False
+
+    def decode_cursor(self, request, model):
+        return None, False
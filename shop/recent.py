@@ -0,0 +1,105 @@
+"""
+Write-behind buffer for "recently viewed" products.
+
+Product detail views only record the view in memory. Each worker flushes its
+buffer with a single multi-row upsert once it holds `RECENT_VIEWS_FLUSH_SIZE`
+entries, every `RECENT_VIEWS_FLUSH_INTERVAL` seconds from a timer thread (so an
+idle worker doesn't sit on views), and once more on exit.
+
+Buffers are per worker: reading a user's history flushes that user's views from
+the current worker only, views held by other workers show up within one interval.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from shop.models import RecentlyViewed
+
+logger = logging.getLogger(__name__)
+
+
+class RecentViewBuffer:
+
+    def __init__(self, max_size, flush_interval):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._views = {}
+        self._flushing = False
+        self._timer = None
+
+    def __len__(self):
+        return len(self._views)
+
+    def record(self, user_id, product_id):
+        with self._lock:
+            self._views[(user_id, product_id)] = timezone.now()
+            self._start_timer()
+            if len(self._views) < self.max_size or self._flushing:
+                return
+            self._flushing = True
+        threading.Thread(target=self._flush_in_background, daemon=True).start()
+
+    def _start_timer(self):
+        # started on first use, and again in forked workers, which don't inherit the parent's threads
+        if self._timer is None or not self._timer.is_alive():
+            self._timer = threading.Thread(target=self._flush_periodically, name='recent-views-flush', daemon=True)
+            self._timer.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            with self._lock:
+                if not self._views or self._flushing:
+                    continue
+                self._flushing = True
+            self._flush_in_background()
+
+    def drain(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                views, self._views = self._views, {}
+            else:
+                views = {key: viewed_at for key, viewed_at in self._views.items() if key[0] == user_id}
+                for key in views:
+                    del self._views[key]
+        return views
+
+    def flush(self, user_id=None):
+        """Writes the buffered views, only those of `user_id` when given"""
+        views = self.drain(user_id)
+        if views:
+            self.write(views)
+        return len(views)
+
+    def write(self, views):
+        with transaction.atomic():
+            RecentlyViewed.objects.record(views)
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to flush recently viewed products')
+        finally:
+            self._flushing = False
+            connections.close_all()
+
+
+recent_views = RecentViewBuffer(
+    max_size=getattr(settings, 'RECENT_VIEWS_FLUSH_SIZE', 500),
+    flush_interval=getattr(settings, 'RECENT_VIEWS_FLUSH_INTERVAL', 30),
+)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        recent_views.flush()
+    except Exception:
+        logger.exception('Failed to flush recently viewed products on exit')
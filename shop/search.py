@@ -0,0 +1,29 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, Q
+
+MAX_QUERY_LENGTH = 100
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())[:MAX_QUERY_LENGTH]
+
+
+def search_products(queryset, query):
+    """
+    Products of `queryset` matching `query`, best match first.
+
+    Matches come from the stored `search_vector` (GIN) or, to tolerate typos, from
+    trigram similarity on the name (GIN, `gin_trgm_ops`), so neither needs a table scan.
+    Ranking happens in the same query as the other filters, so every match passing
+    them can be paginated to; the whole response is cached by `CatalogCacheMixin`.
+    """
+    normalized = normalize_query(query)
+    if not normalized:
+        return queryset.none()
+    search_query = SearchQuery(normalized, config='english', search_type='websearch')
+    return (
+        queryset
+        .filter(Q(search_vector=search_query) | Q(name__trigram_similar=normalized))
+        .alias(rank=SearchRank(F('search_vector'), search_query) + TrigramSimilarity('name', normalized))
+        .order_by('-rank', 'id')
+    )
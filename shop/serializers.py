@@ -1,30 +1,35 @@
 from rest_framework import serializers
+from config.images import ImageSrcsetField
+from shop.fieldsets import SparseFieldsSerializerMixin
 from shop.models import Category, Product
 
 
-class ProductsListSerializer(serializers.ModelSerializer):
+class ProductsListSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name')
+    image_srcset = ImageSrcsetField()
     class Meta:
         model = Product
-        fields = ('id', 'name', 'slug', 'image', 'description', 'price', 'available', 'created', 'updated', 'category', 'category_name')
+        fields = ('id', 'name', 'slug', 'image', 'image_srcset', 'description', 'price', 'available', 'created', 'updated', 'category', 'category_name')
 
 
 class ProductDetailSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ('search_vector', 'image_variants')
 
-class CategoriesListSerializer(serializers.ModelSerializer):
+class CategoriesListSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
+    image_srcset = ImageSrcsetField()
     
     class Meta:
         model = Category
-        fields = '__all__'
+        exclude = ('image_variants',)
 
 
-class CategoryDetailSerializer(serializers.ModelSerializer):
+class CategoryDetailSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
+    image_srcset = ImageSrcsetField()
 
     class Meta:
         model = Category
-        fields = '__all__'
+        exclude = ('image_variants',)
 
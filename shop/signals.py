@@ -0,0 +1,51 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from shop.cache import bump_catalog_version
+from shop.models import Category, Product, ProductImage
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_catalog(sender, **kwargs):
+    # bump after commit so no worker caches the rows as they were before the change
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, **kwargs):
+    deltas = defaultdict(lambda: (0, 0))
+    if not created:
+        category_id = getattr(instance, '_loaded_category_id', None)
+        available = getattr(instance, '_loaded_available', None)
+        if category_id is None or available is None:
+            # loaded without these fields, recount rather than guess
+            Category.objects.refresh_product_counts({instance.category_id, category_id} - {None})
+            remember_counted(instance)
+            return
+        deltas[category_id] = (-1, -int(available))
+    total, available = deltas[instance.category_id]
+    deltas[instance.category_id] = (total + 1, available + int(instance.available))
+    Category.objects.adjust_product_counts(deltas)
+    remember_counted(instance)
+
+
+@receiver(post_delete, sender=Product)
+def uncount_deleted_product(sender, instance, **kwargs):
+    category_id = getattr(instance, '_loaded_category_id', None) or instance.category_id
+    available = getattr(instance, '_loaded_available', None)
+    if available is None:
+        available = instance.available
+    Category.objects.adjust_product_counts({category_id: (-1, -int(available))})
+
+
+def remember_counted(instance):
+    instance._loaded_category_id = instance.category_id
+    instance._loaded_available = instance.available
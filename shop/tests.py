@@ -1,3 +1,414 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import User
+from config.images import get_variants_storage, refresh_variants
+from config.querycount import QueryBudgetExceeded, max_queries
+from shop.models import Category, Product, RecentlyViewed
+from shop.pagination import CategoryProductsPagination
+from shop.recent import RecentViewBuffer
+from shop.views import ProductsListAPIView
+
+
+class ProductKeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Category', slug='category')
+        for i in range(12):
+            Product.objects.create(category=category, name=f'Product {i % 4}', slug=f'product-{i}', price=1000)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_limit_offset_by_default(self):
+        response = self.client.get(reverse('products_list') + '?limit=5')
+        self.assertEqual(response.data['count'], 12)
+        self.assertIn('offset=5', response.data['next'])
+
+    def test_pages_follow_name_then_id(self):
+        url = reverse('products_list') + '?paginate=cursor&limit=5&count=true'
+        response = self.client.get(url)
+        self.assertEqual(response.data['count'], 12)
+        self.assertIsNone(response.data['previous'])
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(response.data['next'])
+        self.assertEqual(second.data['count'], 12)
+        # a row value comparison, which the (name, id) index can range scan
+        self.assertTrue(any('("shop_product"."name", "shop_product"."id") > (' in query['sql'] for query in queries))
+
+        ordered = list(Product.objects.order_by('name', 'id').values_list('id', flat=True))
+        self.assertEqual([product['id'] for product in response.data['results'] + second.data['results']], ordered[:10])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('products_list') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cursor_value(self):
+        cursor = urlsafe_b64encode(json.dumps([['P1', 'abc'], False]).encode('utf-8')).decode('ascii').rstrip('=')
+        response = self.client.get(reverse('products_list'), {'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductsListQueryBudgetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = [Category.objects.create(name=f'Category {i}', slug=f'category-{i}') for i in range(3)]
+        for i in range(30):
+            Product.objects.create(category=categories[i % 3], name=f'Product {i % 10}', slug=f'product-{i}', price=1000 * (i + 1), available=i % 5 != 0)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_products_list_within_budget(self):
+        with max_queries(2):
+            response = self.client.get(reverse('products_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 30)
+
+    @mock.patch.object(ProductsListAPIView, 'query_budget', 1)
+    def test_over_budget_fails_the_suite(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('products_list'))
+
+    def test_products_cursor_pages_within_budget(self):
+        url = reverse('products_list') + '?paginate=cursor&limit=7'
+        pages = []
+        while url:
+            with max_queries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([product['id'] for product in response.data['results']])
+            previous, url = response.data['previous'], response.data['next']
+        seen = [id for page in pages for id in page]
+        self.assertEqual(len(set(seen)), 30)
+        self.assertEqual(seen, list(Product.objects.order_by('name', 'id').values_list('id', flat=True)))
+
+        for page in reversed(pages[:-1]):
+            response = self.client.get(previous)
+            self.assertEqual([product['id'] for product in response.data['results']], page)
+            previous = response.data['previous']
+        self.assertIsNone(previous)
+
+    def test_products_list_served_from_cache_until_catalog_changes(self):
+        url = reverse('products_list')
+        self.client.get(url)
+        with max_queries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data['count'], 30)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(category=Category.objects.first(), name='Product new', slug='product-new', price=10)
+        response = self.client.get(url)
+        self.assertEqual(response.data['count'], 31)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_products_list_not_cached_without_shared_cache(self):
+        url = reverse('products_list')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertTrue(queries)
+
+    def test_filtered_products_list_with_facets(self):
+        category = Category.objects.get(slug='category-1')
+        with max_queries(3):
+            response = self.client.get(reverse('products_list'), {
+                'category': category.slug, 'max_price': 20000, 'available': 'true', 'facets': 'true'
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 6)
+        facets = response.data['facets']
+        self.assertEqual(facets['category'], [{'id': category.id, 'name': category.name, 'count': 6}])
+        self.assertEqual([bucket['count'] for bucket in facets['price']], [1, 2, 3, 0, 0, 0])
+        self.assertEqual(facets['available'], {'true': 6, 'false': 0})
+
+    def test_sparse_fieldset_limits_fields_and_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('products_list'), {'fields': 'id,name,price,category_name', 'paginate': 'cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'price', 'category_name'})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('description', queries[0]['sql'])
+
+        response = self.client.get(reverse('products_list'), {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_category_counts_follow_product_changes(self):
+        response = self.client.get(reverse('categories_list'))
+        counts = {category['slug']: (category['product_count'], category['available_product_count']) for category in response.data['results']}
+        self.assertEqual(counts, {'category-0': (10, 8), 'category-1': (10, 8), 'category-2': (10, 8)})
+
+        product = Product.objects.filter(category__slug='category-0', available=False).first()
+        product.category = Category.objects.get(slug='category-1')
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+        product.available = True
+        product.save()
+        self.assertEqual(
+            list(Category.objects.order_by('slug').values_list('product_count', 'available_product_count')),
+            [(9, 8), (11, 9), (10, 8)]
+        )
+        product.delete()
+        Product.objects.create(category=product.category, name='Product new', slug='product-new', price=10, available=False)
+        self.assertEqual(
+            list(Category.objects.order_by('slug').values_list('product_count', 'available_product_count')),
+            [(9, 8), (11, 8), (10, 8)]
+        )
+
+    def test_restocking_makes_sold_out_product_available_again(self):
+        product = Product.objects.filter(available=True).first()
+        product.stock = 0
+        product.save()
+        self.assertFalse(product.available)
+
+        product = Product.objects.get(pk=product.pk)
+        product.stock = 5
+        product.save()
+        self.assertTrue(Product.objects.get(pk=product.pk).available)
+
+        # hidden by hand, stock changes don't bring it back
+        product.available = False
+        product.save()
+        product = Product.objects.get(pk=product.pk)
+        product.stock = 8
+        product.save()
+        self.assertFalse(Product.objects.get(pk=product.pk).available)
+
+    @mock.patch.object(CategoryProductsPagination, 'page_size', 4)
+    def test_category_detail_embeds_first_page_of_products(self):
+        category = Category.objects.get(slug='category-2')
+        with max_queries(2):
+            response = self.client.get(reverse('category_detail', kwargs={'pk': category.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['product_count'], 10)
+
+        ids, page = [], response.data['products']
+        while True:
+            ids += [product['id'] for product in page['results']]
+            if not page['next']:
+                break
+            page = self.client.get(page['next']).data
+        self.assertEqual(ids, list(category.products.order_by('name', 'id').values_list('id', flat=True)))
+
+        response = self.client.get(reverse('category_detail', kwargs={'pk': category.pk}), {
+            'cursor': parse_qs(urlparse(page['previous']).query)['cursor'][0],
+            'count': 'true',
+        })
+        self.assertEqual([product['id'] for product in response.data['products']['results']], ids[:4])
+        self.assertNotIn('count', response.data['products'])
+
+    def test_created_date_filters_use_datetime_bounds(self):
+        today = timezone.localdate()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('products_list'), {'created_after': str(today), 'created_before': str(today)})
+        self.assertEqual(response.data['count'], 30)
+        self.assertFalse(any('AT TIME ZONE' in query['sql'] for query in queries))
+
+        response = self.client.get(reverse('products_list'), {'created_before': str(today - timedelta(days=1))})
+        self.assertEqual(response.data['count'], 0)
+
+    def test_invalid_filter_is_rejected(self):
+        response = self.client.get(reverse('products_list'), {'min_price': 'cheap'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Bags', slug='bags')
+        Product.objects.create(category=category, name='Canvas Tote', slug='canvas-tote', price=10, description='Canvas with leather handles')
+        Product.objects.create(category=category, name='Leather Bag', slug='leather-bag', price=10)
+        Product.objects.create(category=category, name='Silk Scarf', slug='silk-scarf', price=10)
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('products_list'), {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.data['results']]
+
+    def test_search_ranks_name_matches_first(self):
+        self.assertEqual(self.search('leather'), ['Leather Bag', 'Canvas Tote'])
+
+    def test_search_tolerates_typos(self):
+        self.assertEqual(self.search('lether bag'), ['Leather Bag'])
+
+    def test_search_without_matches(self):
+        self.assertEqual(self.search('umbrella'), [])
+
+    def test_search_ranks_within_the_other_filters(self):
+        category = Category.objects.create(name='Shoes', slug='shoes')
+        Product.objects.create(category=category, name='Leather Boot', slug='leather-boot', price=80)
+        self.assertEqual(self.search('leather', category='shoes'), ['Leather Boot'])
+        self.assertEqual(self.search('leather', max_price='50'), ['Leather Bag', 'Canvas Tote'])
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+    IMAGE_VARIANTS_STORAGE='django.core.files.storage.FileSystemStorage',
+)
+class ImageVariantsTest(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+
+    def upload(self, size=(1600, 1200)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'PNG')
+        return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+    def generate_variants(self):
+        call_command('generate_image_variants', stdout=StringIO())
+
+    def test_variants_generated_by_worker(self):
+        category = Category.objects.create(name='Category', slug='category')
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(category=category, name='Product', slug='product', price=10, image=self.upload())
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants, {})
+        response = self.client.get(reverse('product_detail', args=[product.id]), {'fields': 'image_srcset'})
+        self.assertEqual(response.data['data']['image_srcset']['variants'], {})
+
+        self.generate_variants()
+        product.refresh_from_db()
+        self.assertEqual((product.image_variants['width'], product.image_variants['height']), (1600, 1200))
+        self.assertEqual(
+            {name: (variant['width'], variant['height']) for name, variant in product.image_variants['variants'].items()},
+            {'thumbnail': (150, 113), 'medium': (600, 450), 'large': (1200, 900)}
+        )
+
+        response = self.client.get(reverse('products_list'), {'fields': 'id,image_srcset'})
+        srcset = response.data['results'][0]['image_srcset']
+        self.assertEqual(srcset['width'], 1600)
+        self.assertTrue(srcset['variants']['thumbnail']['url'].endswith('.webp'))
+        self.assertIn(' 600w', srcset['srcset'])
+
+        response = self.client.get(reverse('product_detail', args=[product.id]), {'fields': 'image_srcset'})
+        self.assertEqual(response.data['data']['image_srcset'], srcset)
+
+    def test_replaced_image_variants_deleted(self):
+        category = Category.objects.create(name='Category', slug='category', image=self.upload())
+        self.generate_variants()
+        category.refresh_from_db()
+        old_paths = [variant['name'] for variant in category.image_variants['variants'].values()]
+        storage = get_variants_storage()
+        self.assertTrue(all(storage.exists(path) for path in old_paths))
+
+        category.image = self.upload(size=(800, 600))
+        category.save()
+        self.assertTrue(Category.objects.filter(pk=category.pk, image_variants_stale=True).exists())
+        self.generate_variants()
+        self.assertFalse(Category.objects.filter(image_variants_stale=True).exists())
+        category.refresh_from_db()
+        self.assertEqual(category.image_variants['source'], category.image.name)
+        self.assertFalse(any(storage.exists(path) for path in old_paths))
+        self.assertTrue(all(storage.exists(variant['name']) for variant in category.image_variants['variants'].values()))
+
+        # nothing left to do
+        with max_queries(4):
+            self.generate_variants()
+
+    def test_image_replaced_while_generating_stays_stale(self):
+        category = Category.objects.create(name='Category', slug='category', image=self.upload())
+        stale = Category.objects.get(pk=category.pk)
+        category.image = self.upload(size=(800, 600))
+        category.save()
+
+        self.assertFalse(refresh_variants(stale, 'image'))
+        category.refresh_from_db()
+        self.assertEqual(category.image_variants, {})
+        self.assertTrue(category.image_variants_stale)
+        root = os.path.splitext(stale.image.name)[0]
+        self.assertFalse(get_variants_storage().exists(f'{root}_thumbnail.webp'))
+
+
+class RecentlyViewedTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 'Buyer', 'Example', '08000000000', password='secret')
+        category = Category.objects.create(name='Category', slug='category')
+        cls.products = [Product.objects.create(category=category, name=f'Product {i}', slug=f'product-{i}', price=1000) for i in range(5)]
+
+    def setUp(self):
+        cache.clear()
+
+    def history(self):
+        return list(RecentlyViewed.objects.filter(user=self.user).values_list('product_id', flat=True))
+
+    @override_settings(RECENTLY_VIEWED_LIMIT=3)
+    def test_record_upserts_trims_and_skips_deleted_products(self):
+        start = timezone.now()
+        RecentlyViewed.objects.record({(self.user.pk, product.pk): start + timedelta(seconds=i) for i, product in enumerate(self.products[:3])})
+        # a newer view moves the product to the front, an older one doesn't move it back
+        RecentlyViewed.objects.record({
+            (self.user.pk, self.products[0].pk): start + timedelta(seconds=10),
+            (self.user.pk, self.products[2].pk): start - timedelta(seconds=10),
+            (self.user.pk, self.products[3].pk): start + timedelta(seconds=5),
+            (self.user.pk, 0): start + timedelta(seconds=20),
+        })
+        self.assertEqual(self.history(), [self.products[0].pk, self.products[3].pk, self.products[2].pk])
+
+    def test_buffer_flushes_when_full(self):
+        buffer = RecentViewBuffer(max_size=2, flush_interval=3600)
+        flushed = threading.Event()
+        with mock.patch.object(buffer, 'write', side_effect=lambda views: flushed.set()) as write:
+            buffer.record(self.user.pk, self.products[0].pk)
+            self.assertFalse(flushed.wait(0.1))
+            buffer.record(self.user.pk, self.products[1].pk)
+            self.assertTrue(flushed.wait(5))
+        self.assertEqual(set(write.call_args.args[0]), {(self.user.pk, self.products[0].pk), (self.user.pk, self.products[1].pk)})
+        self.assertEqual(len(buffer), 0)
+
+    def test_idle_buffer_flushes_on_timer(self):
+        buffer = RecentViewBuffer(max_size=100, flush_interval=0.05)
+        flushed = threading.Event()
+        with mock.patch.object(buffer, 'write', side_effect=lambda views: flushed.set()):
+            buffer.record(self.user.pk, self.products[0].pk)
+            self.assertTrue(flushed.wait(5))
+        self.assertEqual(len(buffer), 0)
+
+    def test_history_includes_views_still_buffered(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        for product in (self.products[1], self.products[4]):
+            self.assertEqual(client.get(reverse('product_detail', kwargs={'id': product.pk})).status_code, 200)
+        self.assertEqual(RecentlyViewed.objects.count(), 0)
+
+        response = client.get(reverse('recent-items'))
+        self.assertEqual([item['id'] for item in response.data['data']], [self.products[4].pk, self.products[1].pk])
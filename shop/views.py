@@ -1,63 +1,102 @@
 from django.shortcuts import render
 from rest_framework.generics import ListAPIView, RetrieveAPIView, GenericAPIView
 from rest_framework import permissions, status
-from authentication.models import User
+from config.images import image_srcset
 from shop.models import Category, Product, ProductImage
 from shop.serializers import CategoriesListSerializer, CategoryDetailSerializer, ProductDetailSerializer, ProductsListSerializer
+from shop.cache import CatalogCacheMixin
+from shop.fieldsets import SparseFieldsetMixin
+from shop.filters import ProductFilterBackend, ProductSearchFilterBackend, facets_requested, product_facets
+from shop.pagination import CategoryProductsPagination, ProductCursorPagination
+from shop.recent import recent_views
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
-class ProductsListAPIView(ListAPIView):
+class ProductsListAPIView(CatalogCacheMixin, SparseFieldsetMixin, ListAPIView):
     
     serializer_class = ProductsListSerializer
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('category').defer('search_vector')
     permission_classes = (permissions.AllowAny,)
+    filter_backends = (ProductFilterBackend, ProductSearchFilterBackend)
+    query_budget = 3
 
+    @property
+    def pagination_class(self):
+        # keyset pagination is opt-in (`?paginate=cursor`), limit/offset stays the default
+        # and is always used for search results, which are ordered by relevance
+        request = getattr(self, 'request', None)
+        if ProductCursorPagination.requested(request) and not request.query_params.get('search'):
+            return ProductCursorPagination
+        return api_settings.DEFAULT_PAGINATION_CLASS
 
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if facets_requested(request):
+            response.data['facets'] = product_facets(self.filter_queryset(self.get_queryset()))
+        return response
 
-class ProductDetailAPIView(GenericAPIView):
+
+
+class ProductDetailAPIView(SparseFieldsetMixin, GenericAPIView):
     permission_classes = (permissions.AllowAny,)
+    query_budget = 2
+    available_fields = ('name', 'slug', 'image', 'image_srcset', 'description', 'price', 'stock', 'category', 'extra_images')
+
     def get(self, request, id):
         user = request.user
-        try:
-            # add to user's recently viewed items
-            product_instance = Product.objects.get(id=id)
-            if not user.is_anonymous:
-                user = User.objects.get(email=user)
-                product_instance.user_recent.add(user)
-            product = list(Product.objects.filter(id=id).values('name', 'slug', 'image', 'description', 'price', 'category'))[0]
-
-            other_images = list(ProductImage.objects.filter(product=Product.objects.get(id=id)).values('other_image', 'image_description'))
-        except Product.DoesNotExist:
+        fields = self.get_requested_fields() or self.available_fields
+        columns = {field for field in fields if field not in ('image_srcset', 'extra_images')}
+        if 'image_srcset' in fields:
+            columns |= {'image', 'image_variants'}
+        product = Product.objects.filter(id=id).values(*(columns or ['id'])).first()
+        if product is None:
             return Response({
                 'status': 'Failed', 
                 'message': 'Product Not Found', 
                 'data': []
                 }, status=status.HTTP_404_NOT_FOUND)
-        except:
-            return Response({
-                'status': 'Failed', 
-                'message': 'Unauthorized', 
-                'data': []
-                }, status=status.HTTP_401_UNAUTHORIZED)
+        if 'image_srcset' in fields:
+            product['image_srcset'] = image_srcset(product['image'], product['image_variants'])
+        if 'extra_images' in fields:
+            product['extra_images'] = [{
+                'other_image': image['other_image'],
+                'image_description': image['image_description'],
+                'image_srcset': image_srcset(image['other_image'], image['other_image_variants']),
+            } for image in ProductImage.objects.filter(product_id=id).values('other_image', 'image_description', 'other_image_variants')]
+        product = {field: product[field] for field in fields}
+        if not user.is_anonymous:
+            # add to user's recently viewed items, written in batches by the buffer
+            recent_views.record(user.pk, id)
         return Response({
             'status': 'Success', 
             'message': 'Product Detail View', 
-            'data': {
-                **product,
-                "extra_images": other_images
-            }
+            'data': product
             }, status=status.HTTP_200_OK)
 
 
-class CategoriesListAPIView(ListAPIView):
+class CategoriesListAPIView(CatalogCacheMixin, SparseFieldsetMixin, ListAPIView):
     
     serializer_class = CategoriesListSerializer
     queryset = Category.objects.all()
     permission_classes = (permissions.AllowAny,)
+    query_budget = 2
     
 
-class CategoryDetailAPIView(RetrieveAPIView):
+class CategoryDetailAPIView(CatalogCacheMixin, SparseFieldsetMixin, RetrieveAPIView):
     serializer_class = CategoryDetailSerializer
     permission_classes = (permissions.AllowAny,)
     queryset = Category.objects.all()
+    query_budget = 2
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        data = self.get_serializer(instance).data
+        # first page of the category's products, the `next` link continues in the product list
+        paginator = CategoryProductsPagination()
+        products = Product.objects.filter(category=instance).select_related('category').defer('search_vector')
+        page = paginator.paginate_queryset(products, request, view=self)
+        data['products'] = paginator.get_paginated_response(
+            ProductsListSerializer(page, many=True, context={'request': request}).data
+        ).data
+        return Response(data)
 